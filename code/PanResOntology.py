@@ -1,70 +1,219 @@
-from owlready2 import get_ontology, sync_reasoner
+import argparse
+from owlready2 import sync_reasoner
 import model
 from databases import panres, resfinder, resfinderfg, card, megares, amrfinderplus, argannot, metalres, bacmet, csabapal
 from targets import *
+from stages import Stage, run_stages, save_snapshot
+from functions import entity_index_stats
+from materialize import materialize_inferences
+from profiler import BuildProfiler
+from pubmed import add_pubmed_annotations
+from contextlib import nullcontext
 
 from loguru import logger
 
-logger.add("panres_messages.log")
-
-onto = get_ontology("http://genepi.dk/PanResOntology.owl")
-logger.success(f"Created an empty ontology: {onto.base_iri}")
-
-model.createModel(onto)
-logger.success("Created the ontology model.")
-
-# Define targets
-load_targets(excelfile='data/targets.xlsx', onto=onto, logger=logger)
-
-# Load into data from first version of PanRes
-panres.add_panres_genes("data/PanRes_data_v1.0.0.tsv", onto = onto, logger = logger, discarded='data/discarded/panres_removed_headers.txt')
-
-# add proteins
-panres.add_panres_proteins(file = 'data/proteins/panres_final_protein.faa', clstrs='data/proteins/panres_final_protein_50_90.faa.clstr', onto = onto, logger = logger)
-
-# Load data about ResFinder genes
-resfinder.add_resfinder_annotations("data/phenotypes.txt", onto, logger=logger)
-
-# Load data about CARD genes
-card.add_card_annotations("data/aro_index.tsv", onto, logger=logger)
-
-# Load data about MegaRes genes
-megares.add_megares_annotations(onto, logger=logger, mappingfile='data/megares_to_external_header_mappings_v3.00.csv')
-
-# Load data about ResFinderFG genes
-resfinderfg.add_resfinderfg_annotations("data/resfinderfg_anno.txt", onto, logger=logger)
-
-# Load data about AMRFinderPlus genes
-amrfinderplus.add_amrfinderplus_annotations("data/ReferenceGeneCatalog.txt", onto, logger=logger)
-
-# Load data about ARGANNOT genes
-argannot.add_argannot_annotations(onto, logger=logger)
-
-# Load data about MetalRes genes
-metalres.add_metalres_annotations(onto, logger=logger)
-
-# Load data about BacMet genes
-bacmet.add_bacmet_annotations(onto, mappingfile='data/BacMet_EXP.704.mapping.txt', logger=logger)
-
-# Load data about CsabaPal genes
-csabapal.add_csabapal_annotations(onto = onto, file='data/QSX_607_CsabaPal_metagenomics_metadata_final_notfiltered.csv', logger=logger)
-
-# Remove unusued classes of AntimicrobialResistanceClass and AntimicrobialResistancePhenotype 
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.AntibioticResistanceClass, property_name='has_resistance_class', logger=logger)
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.AntibioticResistancePhenotype, property_name='has_predicted_phenotype', logger=logger)
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.Metal, property_name='has_predicted_phenotype', logger=logger)
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.Biocide, property_name='has_predicted_phenotype', logger=logger)
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.BiocideClass, property_name='has_resistance_class', logger=logger)
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.UnclassifiedResistance, property_name='has_predicted_phenotype', logger=logger)
-remove_unused_subclasses_with_property(onto=onto, parent_cls=onto.ResistanceMechanism, property_name='has_mechanism_of_resistance', logger=logger)
-
-reclassify_genes(onto)
-
-logger.info("Syncing ontology reasonings..")
-sync_reasoner(debug=0, infer_property_values = True)
-# sync_reasoner_pellet(infer_property_values = False, infer_data_property_values = False, debug=0)
-
-# Save the ontology to a file
-ont_file = 'ontology/panres_v2.owl'
-onto.save(file=ont_file, format="rdfxml")
-logger.info(f"Saved ontology to file: {ont_file}.")
\ No newline at end of file
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default='build_cache',
+        help='Directory for caching the ontology after each build stage',
+        dest='cache_dir'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Rebuild the ontology from scratch without reading or writing the stage cache',
+        dest='no_cache'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes for parsing the annotation files (default: one per CPU)',
+        dest='workers'
+    )
+    parser.add_argument(
+        '--quadstore',
+        type=str,
+        default=None,
+        help='Also save the ontology as an owlready2 SQLite quadstore to this file (e.g. ontology/panres_v2.sqlite3)',
+        dest='quadstore'
+    )
+    parser.add_argument(
+        '--reasoner',
+        type=str,
+        default='hermit',
+        choices=['hermit', 'native'],
+        help='Reasoner for the last stage: HermiT (requires Java) or the native materializer of the inferences the ontology relies on',
+        dest='reasoner'
+    )
+    parser.add_argument(
+        '--pubmed',
+        action='store_true',
+        help='Annotate the genes with the PubMed IDs linked to their accessions, looked up at NCBI',
+        dest='pubmed'
+    )
+    parser.add_argument(
+        '--pubmed-cache',
+        type=str,
+        default='pubmed_cache.sqlite3',
+        help='Cache of the PubMed lookups, reused across builds',
+        dest='pubmed_cache'
+    )
+    parser.add_argument(
+        '--pubmed-fixture',
+        type=str,
+        default=None,
+        help='JSON file mapping accessions to PubMed IDs, to look up the PubMed IDs offline',
+        dest='pubmed_fixture'
+    )
+    parser.add_argument(
+        '--profile-dir',
+        type=str,
+        default=None,
+        help='Profile each build stage and write a JSON report to this directory (set PANRES_CPROFILE=1 to also dump a cProfile per stage)',
+        dest='profile_dir'
+    )
+
+    return parser.parse_args()
+
+def create_model(onto, logger):
+    model.createModel(onto)
+    logger.success("Created the ontology model.")
+
+def remove_unused_targets(onto, logger):
+    # Remove unusued classes of AntimicrobialResistanceClass and AntimicrobialResistancePhenotype
+    remove_unused_subclasses(
+        onto=onto,
+        parents=[
+            (onto.AntibioticResistanceClass, 'has_resistance_class'),
+            (onto.AntibioticResistancePhenotype, 'has_predicted_phenotype'),
+            (onto.Metal, 'has_predicted_phenotype'),
+            (onto.Biocide, 'has_predicted_phenotype'),
+            (onto.BiocideClass, 'has_resistance_class'),
+            (onto.UnclassifiedResistance, 'has_predicted_phenotype'),
+            (onto.ResistanceMechanism, 'has_mechanism_of_resistance'),
+        ],
+        logger=logger
+    )
+
+def reclassify(onto, logger):
+    reclassify_genes(onto)
+
+def reason(onto, logger):
+    logger.info("Syncing ontology reasonings..")
+    sync_reasoner(debug=0, infer_property_values = True)
+    # sync_reasoner_pellet(infer_property_values = False, infer_data_property_values = False, debug=0)
+
+stages = [
+    Stage('model', create_model),
+
+    # Define targets
+    Stage('targets', load_targets, inputs=['data/targets.xlsx'], kwargs={'excelfile': 'data/targets.xlsx'}),
+
+    # Load into data from first version of PanRes
+    Stage('panres_genes', panres.add_panres_genes,
+          inputs=['data/PanRes_data_v1.0.0.tsv', 'data/discarded/panres_removed_headers.txt'],
+          kwargs={'file': 'data/PanRes_data_v1.0.0.tsv', 'discarded': 'data/discarded/panres_removed_headers.txt'}),
+
+    # add proteins
+    Stage('panres_proteins', panres.add_panres_proteins,
+          inputs=['data/proteins/panres_final_protein.faa', 'data/proteins/panres_final_protein_50_90.faa.clstr'],
+          kwargs={'file': 'data/proteins/panres_final_protein.faa', 'clstrs': 'data/proteins/panres_final_protein_50_90.faa.clstr',
+                  'cluster_table': 'ontology/panres_protein_clusters_50_90'},
+          outputs=['ontology/panres_protein_clusters_50_90.members.txt', 'ontology/panres_protein_clusters_50_90.clusters.npy']),
+
+    # Load data about ResFinder genes
+    Stage('resfinder', resfinder.add_resfinder_annotations, inputs=['data/phenotypes.txt'], kwargs={'file': 'data/phenotypes.txt'},
+          parse=resfinder.parse_resfinder_annotations),
+
+    # Load data about CARD genes
+    Stage('card', card.add_card_annotations, inputs=['data/aro_index.tsv'], kwargs={'file': 'data/aro_index.tsv'},
+          parse=card.parse_card_annotations),
+
+    # Load data about MegaRes genes
+    Stage('megares', megares.add_megares_annotations,
+          inputs=['data/megares_to_external_header_mappings_v3.00.csv'],
+          kwargs={'mappingfile': 'data/megares_to_external_header_mappings_v3.00.csv'},
+          parse=megares.parse_megares_annotations),
+
+    # Load data about ResFinderFG genes
+    Stage('resfinderfg', resfinderfg.add_resfinderfg_annotations, inputs=['data/resfinderfg_anno.txt'], kwargs={'file': 'data/resfinderfg_anno.txt'},
+          parse=resfinderfg.parse_resfinderfg_annotations),
+
+    # Load data about AMRFinderPlus genes
+    Stage('amrfinderplus', amrfinderplus.add_amrfinderplus_annotations, inputs=['data/ReferenceGeneCatalog.txt'], kwargs={'file': 'data/ReferenceGeneCatalog.txt'},
+          parse=amrfinderplus.parse_amrfinderplus_annotations),
+
+    # Load data about ARGANNOT genes
+    Stage('argannot', argannot.add_argannot_annotations),
+
+    # Load data about MetalRes genes
+    Stage('metalres', metalres.add_metalres_annotations),
+
+    # Load data about BacMet genes
+    Stage('bacmet', bacmet.add_bacmet_annotations, inputs=['data/BacMet_EXP.704.mapping.txt'], kwargs={'mappingfile': 'data/BacMet_EXP.704.mapping.txt'},
+          parse=bacmet.parse_bacmet_annotations),
+
+    # Load data about CsabaPal genes
+    Stage('csabapal', csabapal.add_csabapal_annotations,
+          inputs=['data/QSX_607_CsabaPal_metagenomics_metadata_final_notfiltered.csv'],
+          kwargs={'file': 'data/QSX_607_CsabaPal_metagenomics_metadata_final_notfiltered.csv'},
+          parse=csabapal.parse_csabapal_annotations),
+
+    # Remove unused target classes
+    Stage('remove_unused', remove_unused_targets),
+
+    Stage('reclassify', reclassify),
+
+    Stage('reasoning', reason),
+]
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    logger.add("panres_messages.log")
+
+    # Replace HermiT by the native materializer
+    if args.reasoner == 'native':
+        stages = [Stage('reasoning', materialize_inferences) if stage.name == 'reasoning' else stage for stage in stages]
+
+    # Add the PubMed IDs after all annotations are loaded, before pruning the targets
+    if args.pubmed:
+        pubmed_stage = Stage('pubmed', add_pubmed_annotations, inputs=[args.pubmed_fixture] if args.pubmed_fixture is not None else [],
+                             kwargs={'cache_file': args.pubmed_cache, 'fixture': args.pubmed_fixture})
+        i = [stage.name for stage in stages].index('remove_unused')
+        stages = stages[:i] + [pubmed_stage] + stages[i:]
+
+    profiler = BuildProfiler(args.profile_dir) if args.profile_dir is not None else None
+
+    # Build the ontology, reusing the cached stages whose inputs did not change
+    onto = run_stages(
+        stages,
+        base_iri="http://genepi.dk/PanResOntology.owl",
+        logger=logger,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        workers=args.workers,
+        profiler=profiler
+    )
+
+    logger.info(f"Entity index lookups: {entity_index_stats['hits']} hits, {entity_index_stats['misses']} misses.")
+
+    with profiler.stage('save', onto) if profiler is not None else nullcontext():
+        # Save the ontology to a file
+        ont_file = 'ontology/panres_v2.owl'
+        onto.save(file=ont_file, format="rdfxml")
+        logger.info(f"Saved ontology to file: {ont_file}.")
+
+        # Save the quadstore, which can be opened without parsing the OWL file
+        if args.quadstore is not None:
+            save_snapshot(onto, args.quadstore)
+            logger.info(f"Saved ontology quadstore to file: {args.quadstore}.")
+
+    # Write the profile of the build
+    if profiler is not None:
+        report_file = profiler.write(reasoner=args.reasoner, workers=args.workers, entity_index=dict(entity_index_stats))
+        logger.info(f"Wrote build profile to file: {report_file}.")
@@ -0,0 +1,296 @@
+import os
+import sys
+import glob
+import json
+import math
+import shutil
+import argparse
+import subprocess
+import pandas as pd
+from loguru import logger
+
+# Queries of functions.py to time on the built ontology: (function name, keyword arguments)
+queries = [
+    ('get_genes_from_database', {'database_name': 'CARD'}),
+    ('get_subclasses', {'class_name': 'AntibioticResistanceClass'}),
+    ('summarise_classes', {'class_name': 'AntibioticResistanceClass'}),
+    ('get_genes_for_class', {'class_name': 'Aminoglycoside'}),
+]
+
+# Steps whose time grows faster than this power of the scale are reported as superlinear
+superlinear_exponent = 1.3
+
+# Stage the resume check restores the build from, the last one before the database annotations are loaded
+resume_stage = 'panres_proteins'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the ontology build, export and queries on synthetic data of increasing size')
+
+    parser.add_argument(
+        '-s', '--scales',
+        type=float,
+        nargs='+',
+        default=[1, 10, 100],
+        help='Number of genes relative to PanRes v1.0.0 for each benchmark run',
+        dest='scales'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default='benchmarks',
+        help='Directory for the synthetic data, the reports of each run and the scaling curves',
+        dest='output'
+    )
+    parser.add_argument(
+        '--trace-memory',
+        action='store_true',
+        help='Also trace the allocations of each step with tracemalloc, which slows down the runs',
+        dest='trace_memory'
+    )
+    parser.add_argument(
+        '--check-resume',
+        action='store_true',
+        help=f"Also check that a build resumed from the cached '{resume_stage}' stage has the same triples as a cold build",
+        dest='check_resume'
+    )
+    parser.add_argument(
+        '--run',
+        type=str,
+        default=None,
+        help=argparse.SUPPRESS,
+        dest='run'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help=argparse.SUPPRESS,
+        dest='cache_dir'
+    )
+
+    return parser.parse_args()
+
+def synthetic_stages(data_dir: str, output: str) -> list:
+    """The build stages of PanResOntology.py, reading their inputs from a synthetic data directory
+
+    HermiT is replaced by the native materializer, so the benchmark does not depend on Java.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the synthetic data files
+    output : str
+        Directory to write the outputs of the stages to
+
+    Returns
+    -------
+    list
+        List of Stage objects
+    """
+    import PanResOntology
+    from stages import Stage
+    from materialize import materialize_inferences
+
+    def relocate(value):
+        if isinstance(value, str) and value.startswith('data/'):
+            return os.path.join(data_dir, value[len('data/'):])
+        if isinstance(value, str) and value.startswith('ontology/'):
+            return os.path.join(output, value[len('ontology/'):])
+        return value
+
+    stages = []
+    for stage in PanResOntology.stages:
+        if stage.name == 'reasoning':
+            stages.append(Stage('reasoning', materialize_inferences))
+            continue
+        stages.append(Stage(
+            stage.name,
+            stage.func,
+            inputs=[relocate(i) for i in stage.inputs],
+            kwargs={k: relocate(v) for k, v in stage.kwargs.items()},
+            parse=stage.parse,
+            outputs=[relocate(o) for o in stage.outputs]
+        ))
+    return stages
+
+def run_benchmark(data_dir: str, output: str, trace_memory: bool = False, cache_dir: str = None) -> str:
+    """Build the ontology from a synthetic data directory and time each stage, the export and the queries
+
+    This has to run in a fresh process, as it builds into the default world.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the synthetic data files
+    output : str
+        Directory to write the ontology and the report to
+    trace_memory : bool, optional
+        Trace the allocations of each step with tracemalloc, by default False
+    cache_dir : str, optional
+        Directory of the stage cache, by default None (no caching)
+
+    Returns
+    -------
+    str
+        Path of the report
+    """
+    import functions
+    from stages import run_stages
+    from profiler import BuildProfiler
+
+    logger.remove()
+    profiler = BuildProfiler(output, trace_memory=trace_memory)
+
+    onto = run_stages(
+        synthetic_stages(data_dir, output),
+        base_iri="http://genepi.dk/PanResOntology.owl",
+        logger=logger,
+        cache_dir=cache_dir,
+        workers=1,
+        profiler=profiler
+    )
+
+    ont_file = os.path.join(output, 'panres_v2.owl')
+    with profiler.stage('save', onto):
+        onto.save(file=ont_file, format="rdfxml")
+
+    # export.py reads the OWL file in a process of its own
+    with profiler.stage('export', onto):
+        subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export.py'), '-f', ont_file, '-o', os.path.join(output, 'export', 'panres_genes.csv')],
+            check=True
+        )
+
+    for name, kwargs in queries:
+        with profiler.stage(name, onto):
+            getattr(functions, name)(onto=onto, **kwargs)
+
+    return profiler.write(data=data_dir, genes=len(list(onto.PanGene.instances())))
+
+def run_process(data_dir: str, output: str, trace_memory: bool = False, cache_dir: str = None) -> str:
+    """Run a single benchmark in a fresh process, see run_benchmark
+
+    Returns
+    -------
+    str
+        Path of the report
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), '--run', data_dir, '-o', output]
+    if trace_memory:
+        cmd.append('--trace-memory')
+    if cache_dir is not None:
+        cmd += ['--cache-dir', cache_dir]
+    p = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True)
+    return p.stdout.strip().splitlines()[-1]
+
+def check_resume(data_dir: str, output: str) -> bool:
+    """Check that a build resumed from a cached stage has the same triples as a cold build
+
+    The ontology is built once with an empty stage cache, then the snapshots after the
+    resume_stage are removed and the ontology is built again from the snapshot of that stage.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the synthetic data files
+    output : str
+        Directory to write both builds and the stage cache to
+
+    Returns
+    -------
+    bool
+        True if both builds have the same triples
+    """
+    from diff import diff_ontologies
+
+    cache_dir = os.path.join(output, 'cache')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    run_process(data_dir, os.path.join(output, 'cold'), cache_dir=cache_dir)
+
+    # Drop the snapshots of the stages after the resume stage
+    names = [stage.name for stage in synthetic_stages(data_dir, output)]
+    for i in range(names.index(resume_stage) + 1, len(names)):
+        for snapshot in glob.glob(os.path.join(cache_dir, f"{i:02d}_{names[i]}_*.sqlite3")):
+            os.remove(snapshot)
+    run_process(data_dir, os.path.join(output, 'resumed'), cache_dir=cache_dir)
+
+    entities, triples = diff_ontologies(os.path.join(output, 'cold', 'panres_v2.owl'), os.path.join(output, 'resumed', 'panres_v2.owl'))
+    if len(entities) > 0:
+        logger.error(f"The build resumed from '{resume_stage}' differs from the cold build in {len(entities)} entities and {len(triples)} triples:\n{triples.head(20).to_string(index=False)}")
+        return False
+    return True
+
+def scaling_curves(reports: dict) -> pd.DataFrame:
+    """Combine the reports of the benchmark runs into the wall time of each step per scale
+
+    The scaling exponent of a step is estimated from the smallest and largest scale: 1 means
+    the time grows linearly with the number of genes, 2 quadratically.
+
+    Parameters
+    ----------
+    reports : dict
+        Paths of the reports, keyed by scale
+
+    Returns
+    -------
+    pd.DataFrame
+        Wall times with one row per step and one column per scale, and the estimated exponent
+    """
+    times = {}
+    for scale, report_file in sorted(reports.items()):
+        with open(report_file) as f:
+            report = json.load(f)
+        times[scale] = {s['name']: s['wall_time'] for s in report['stages'] if not s['cached']}
+
+    curves = pd.DataFrame(times)
+    curves.index.name = 'step'
+    curves.columns = [f"{scale:g}x" for scale in curves.columns]
+
+    smallest, largest = min(reports), max(reports)
+    if largest > smallest:
+        t0, t1 = curves.iloc[:, 0], curves.iloc[:, -1]
+        curves['exponent'] = [
+            round(math.log(b / a) / math.log(largest / smallest), 2) if a > 0 and b > 0 else None
+            for a, b in zip(t0, t1)
+        ]
+    return curves
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Single benchmark run, started by the benchmark suite below
+    if args.run is not None:
+        print(run_benchmark(data_dir=args.run, output=args.output, trace_memory=args.trace_memory, cache_dir=args.cache_dir))
+        sys.exit(0)
+
+    from synthetic import generate
+
+    reports = {}
+    for scale in args.scales:
+        data_dir = os.path.join(args.output, f"data_{scale:g}x")
+        run_dir = os.path.join(args.output, f"run_{scale:g}x")
+
+        # Generate the synthetic data once per scale
+        if not os.path.exists(os.path.join(data_dir, 'PanRes_data_v1.0.0.tsv')):
+            n_genes = generate(output=data_dir, scale=scale)
+            logger.info(f"Generated synthetic data for {n_genes} genes ({scale:g}x) in {data_dir}.")
+
+        logger.info(f"Benchmarking the build at {scale:g}x..")
+        reports[scale] = run_process(data_dir, run_dir, trace_memory=args.trace_memory)
+        logger.success(f"Benchmark report at {scale:g}x: {reports[scale]}")
+
+        if args.check_resume:
+            if not check_resume(data_dir, os.path.join(args.output, f"resume_{scale:g}x")):
+                sys.exit(1)
+            logger.success(f"The build resumed from '{resume_stage}' at {scale:g}x has the same triples as the cold build.")
+
+    # Write the scaling curves and point out the steps that do not scale linearly
+    curves = scaling_curves(reports)
+    curves_file = os.path.join(args.output, 'scaling.csv')
+    curves.to_csv(curves_file)
+    logger.info(f"Wall time (s) per step and scale, written to {curves_file}:\n{curves.to_string()}")
+
+    if 'exponent' in curves:
+        superlinear = curves[curves['exponent'] > superlinear_exponent]
+        if len(superlinear) > 0:
+            logger.warning("Steps scaling superlinearly with the number of genes:\n" + '\n'.join([f"{step}: time ~ scale^{e}" for step, e in superlinear['exponent'].items()]))
@@ -6,7 +6,7 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 agg_funcs = {
     'class': lambda x: '/'.join(x.unique())
@@ -14,7 +14,29 @@ agg_funcs = {
 
 compound2compound = {'Quaternary Ammonium': 'Quaternary Ammonium Compounds (QACs)'}
 
-def add_amrfinderplus_annotations(file: str, onto: Ontology, logger, db_name: str = 'AMRFinderPlus'):
+def parse_amrfinderplus_annotations(file: str) -> dict:
+    """Parse and clean the AMRFinderPlus annotation file. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    file : str
+        Path to the file containing AMRFinderPlus annotations
+
+    Returns
+    -------
+    dict
+        The cleaned AMRFinderPlus annotations aggregated with agg_funcs, keyed by RefSeq protein accession
+    """
+
+    # Load the annotation file
+    amrfinderplus_anno = pd.read_csv(file, sep='\t')
+
+    # Replace nan strings with actual NaN values and fill with empty strings
+    string_columns = amrfinderplus_anno.select_dtypes(include='object').columns
+    amrfinderplus_anno[string_columns] = amrfinderplus_anno[string_columns].replace('nan', np.nan).fillna('')
+    return amrfinderplus_anno.groupby("refseq_protein_accession").agg(agg_funcs).to_dict('index')
+
+def add_amrfinderplus_annotations(file: str, onto: Ontology, logger, db_name: str = 'AMRFinderPlus', parsed: dict = None):
     """Add AMRFinderPlus annotations to the
 
     Parameters
@@ -27,21 +49,19 @@ def add_amrfinderplus_annotations(file: str, onto: Ontology, logger, db_name: st
         Logger object for logging messages
     db_name : str, optional
         Name of the database in the ontolgoy, by default 'AMRFinderPlus'
+    parsed : dict, optional
+        Output of parse_amrfinderplus_annotations, parsed from file if not given, by default None
     """
 
     # Load the annotation file
-    amrfinderplus_anno = pd.read_csv(file, sep='\t')
-
-    # Replace nan strings with actual NaN values and fill with empty strings
-    string_columns = amrfinderplus_anno.select_dtypes(include='object').columns
-    amrfinderplus_anno[string_columns] = amrfinderplus_anno[string_columns].replace('nan', np.nan).fillna('')
+    amrfinderplus_anno = parse_amrfinderplus_annotations(file) if parsed is None else parsed
 
     # Find the genes from the specified database in the ontology
     matched_genes = find_genes_from_database(onto, database_name=db_name)
 
-    # Lists for storing failed matches (for logging purposes)
+    # Lists for storing failed matches (for logging purposes) and the target assignments
     failed_matches = []
-    failed_ab_matches = defaultdict(list)
+    assignments = []
 
     # Loop through matched pan_ genes and original gene names to add the annotations
     for gene, og in matched_genes.items():
@@ -49,32 +69,29 @@ def add_amrfinderplus_annotations(file: str, onto: Ontology, logger, db_name: st
         # Extract the fasta header for the current gene
         fasta_header = [fh for fh in og.original_fasta_header if db_name in fh][0]
 
-        # Match the annotation data based on the refseq protein accession
-        m = amrfinderplus_anno.loc[amrfinderplus_anno["refseq_protein_accession"] == fasta_header.split('|')[1]]
-        m = m.groupby("refseq_protein_accession").agg(agg_funcs).reset_index()
+        # Match the aggregated annotation data based on the refseq protein accession
+        m = amrfinderplus_anno.get(fasta_header.split('|')[1])
 
         # Log if no matches were foiund
-        if m.shape[0] == 0:
+        if m is None:
             failed_matches.append(f"{gene.name} ({og.name})")
             continue
 
         # Split the antibiotic classes and add those annotations to the gene instances
-        ab_classes = m['class'].item().split('/')
+        ab_classes = m['class'].split('/')
         for ab_class in ab_classes:
             ab_class = compound2compound.get(ab_class.title(), ab_class.title())
-            success_match = gene_target(gene, og, target=ab_class, onto=onto, db_name=db_name)
+            assignments.append((gene, og, ab_class, db_name))
 
-            # log if no successful match
-            if not success_match:
-                failed_ab_matches[ab_class] = f"{gene.name} ({og.name})"
+    # Add the antibiotic classes to the ontology
+    failed_ab_matches = apply_targets(assignments, onto=onto)
 
     # Output logging messages for any failed matches
     if len(failed_matches) > 0:
         logger.error(f"{db_name}: Failed to find the genes in the annotation file ({file}): {', '.join(failed_matches)}")    
     
     if len(failed_ab_matches) > 0:
-        failed_ab_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k, v in failed_ab_matches.items()])
-        logger.warning(f"{db_name}: Failed to find the annotations for the following antibiotics:\n" + failed_ab_matches_string)
+        logger.warning(f"{db_name}: Failed to find the annotations for the following antibiotics:\n" + format_failed_targets(failed_ab_matches))
 
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
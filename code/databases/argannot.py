@@ -5,7 +5,7 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 acr2class = {
     'AGly': 'Aminoglycoside',
@@ -40,7 +40,7 @@ def add_argannot_annotations(onto: Ontology, logger, db_name: str = 'ARGANNOT'):
 
     # Lists for storing failed matches
     failed_regex_matches = list()
-    failed_ab_matches = defaultdict(list)
+    assignments = []
 
     # Compile a regular expression to match class acronyms in fasta headers
     p = re.compile(r"\|\((\w{3,4})\)")
@@ -58,25 +58,23 @@ def add_argannot_annotations(onto: Ontology, logger, db_name: str = 'ARGANNOT'):
         if ab_acronym is not None and ab_acronym in acr2class.keys():
             antibiotics = acr2class[ab_acronym].title()
 
-            # Ad the annotations for the gene in question
+            # Collect the annotations for the gene in question
             for ab in antibiotics.split('/'):
-                success_match = gene_target(gene, og, target=ab, onto=onto, db_name=db_name)
-
-                # log if no successful match
-                if not success_match:
-                    failed_ab_matches[ab].append(f"{gene.name} ({og.name})")
+                assignments.append((gene, og, ab, db_name))
         
         # log if no successful acronym match
         else:
             failed_regex_matches.append(f"{gene.name} ({og.name})")
         
+    # Add the annotations to the ontology
+    failed_ab_matches = apply_targets(assignments, onto=onto)
+
     # Output logging messages if any failed matches
     if len(failed_regex_matches) > 0:
         logger.warning(f"{db_name}: Failed to extract class acronyms: {', '.join(failed_regex_matches)}")    
 
     if len(failed_ab_matches) > 0:
-        failed_ab_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k, v in failed_ab_matches.items()])
-        logger.warning("{db_name}: Failed to find target annotations for:\n" + failed_ab_matches_string)
+        logger.warning(f"{db_name}: Failed to find target annotations for:\n" + format_failed_targets(failed_ab_matches))
     
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
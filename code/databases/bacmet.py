@@ -6,14 +6,75 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import get_instance, get_or_create_instance, accession_to_pubmed, find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 agg_funcs = {
     'Compound': lambda x: ",".join(x),
     'Accession': lambda x: ",".join(x)
 }
 
-def add_bacmet_annotations(onto: Ontology, mappingfile: str, logger, db_name: str = 'BacMet'):
+# Regular expressions to match compounds and classes
+p = re.compile(r"^((\w+)(\s\w+)?)\s")
+p_class = re.compile(r"^((\w+)(\s\w+)?)\s(\[class\W+((\w+)(\s\w+)?)\])")
+
+def parse_compounds(compounds: str) -> list:
+    """Extract the compounds and their classes from the comma-separated BacMet compound annotations
+
+    Parameters
+    ----------
+    compounds : str
+        Comma-separated compound annotations, e.g. 'Triclosan [class: Phenolic compounds], Iron (Fe)'
+
+    Returns
+    -------
+    list
+        (compound, class) tuples, where class is None if the compound has no class annotation
+    """
+    parsed = []
+    for compound in set(compounds.split(',')):
+        # test if its a class or an actual compound
+        if 'class' in compound:
+            m_compound = p_class.findall(compound.strip())
+        else:
+            m_compound = p.findall(compound.strip())
+        
+        # Check if match is found and get it
+        if len(m_compound) > 0:
+            parsed.append((m_compound[0][0], m_compound[0][4] if len(m_compound[0]) > 3 else None))
+    return parsed
+
+def parse_bacmet_annotations(mappingfile: str) -> dict:
+    """Parse the BacMet annotation file into an alias index. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    mappingfile : str
+        Path to the file containing BacMet annotations
+
+    Returns
+    -------
+    dict
+        For each lower-cased gene name alias, a list with one record per BacMet gene name. Each record
+        holds the Gene_name, the aggregated Compound and Accession annotations and the parsed compounds.
+    """
+
+    # Load the annotation file
+    exp_annotations = pd.read_csv(mappingfile, sep='\t')
+
+    # Clean up strings
+    exp_annotations['gene_name'] = exp_annotations['Gene_name'].str.lower().str.split('/')
+    exp_annotations = exp_annotations.explode('gene_name')
+
+    # Aggregate the annotations per alias and gene name
+    m = exp_annotations.groupby(['gene_name', 'Gene_name']).agg(agg_funcs).reset_index()
+
+    alias_index = defaultdict(list)
+    for record in m.to_dict('records'):
+        record['compounds'] = parse_compounds(record['Compound'])
+        alias_index[record.pop('gene_name')].append(record)
+    return dict(alias_index)
+
+def add_bacmet_annotations(onto: Ontology, mappingfile: str, logger, db_name: str = 'BacMet', parsed: dict = None):
     """Adds BacMet annotations to the ontology.
 
     Parameters
@@ -26,23 +87,17 @@ def add_bacmet_annotations(onto: Ontology, mappingfile: str, logger, db_name: st
         Logger object for logging messages  
     db_name : str, optional
         Name of the database in the ontology, by default 'BacMet'
+    parsed : dict, optional
+        Output of parse_bacmet_annotations, parsed from mappingfile if not given, by default None
     """
 
     # Load the annotation file
-    exp_annotations = pd.read_csv(mappingfile, sep='\t')
-
-    # Clean up strings
-    exp_annotations['gene_name'] = exp_annotations['Gene_name'].str.lower().str.split('/')
-    exp_annotations = exp_annotations.explode('gene_name')
+    alias_index = parse_bacmet_annotations(mappingfile) if parsed is None else parsed
 
     # Lists for storing failed matches
     failed_matches = []
-    failed_type_matches = defaultdict(list)
-    failed_class_matches = defaultdict(list)
-
-    # Compile regular expressions to match compounds and classes
-    p = re.compile(r"^((\w+)(\s\w+)?)\s")
-    p_class = re.compile(r"^((\w+)(\s\w+)?)\s(\[class\W+((\w+)(\s\w+)?)\])")
+    type_assignments = []
+    class_assignments = []
 
     # Get the database instance from the ontology
     db_instance = get_instance(onto=onto, name=db_name)
@@ -57,15 +112,12 @@ def add_bacmet_annotations(onto: Ontology, mappingfile: str, logger, db_name: st
         meg_gene_name = meg_header.split('|')[-2].lower()
 
         # Match the annotation data based on the gene name
-        m = exp_annotations.loc[
-            (exp_annotations['gene_name'] == meg_gene_name)
-        ].groupby(['Gene_name']).agg(agg_funcs).reset_index()
+        m = alias_index.get(meg_gene_name, [])
 
         # Only allowing for one match
-        if m.shape[0] == 1:
-            # Find compounds and original gene names
-            compounds = m['Compound'].item()
-            original_name = m['Gene_name'].item()
+        if len(m) == 1:
+            # Find original gene names
+            original_name = m[0]['Gene_name']
 
             # Create or get the original gene name instance
             og = get_or_create_instance(onto = onto, cls=onto.OriginalGene, name=original_name)
@@ -74,44 +126,32 @@ def add_bacmet_annotations(onto: Ontology, mappingfile: str, logger, db_name: st
             og.is_from_database.append(db_instance)
             gene.equivalent_to.append(og)
 
-            # Set metal resistance annotations
-            for compound in set(compounds.split(',')):
-                # test if its a class or an actual compound
-                if 'class' in compound:
-                    m_compound = p_class.findall(compound.strip())
-                else:
-                    m_compound = p.findall(compound.strip())
-                
-                # Check if match is found and get it
-                if len(m_compound) > 0:
-                    c = m_compound[0][0]
-
-                    # add the annotation and if it fails, log it
-                    if not gene_target(gene=gene, og=og, target=c, onto=onto, db_name=db_name):
-                        failed_type_matches[c].append(f"{gene.name} ({og.name})")
-                    if len(m_compound[0]) > 3:
-                        cc = m_compound[0][4]
-                        if not gene_target(gene=gene, og=og, target=cc, onto=onto, db_name=db_name):
-                            failed_class_matches[cc].append(f"{gene.name} ({og.name})")
+            # Set metal resistance annotations from the parsed compounds and classes
+            for c, cc in m[0]['compounds']:
+                type_assignments.append((gene, og, c, db_name))
+                if cc is not None:
+                    class_assignments.append((gene, og, cc, db_name))
             
             # Add gene accession numbers
-            for accession in m['Accession'].item().split(','):
+            for accession in m[0]['Accession'].split(','):
                 gene.accession.append(accession)
                 og.accession.append(accession)
         else:
             failed_matches.append(gene.name)
     
+    # Add the compound and class annotations to the ontology
+    failed_type_matches = apply_targets(type_assignments, onto=onto)
+    failed_class_matches = apply_targets(class_assignments, onto=onto)
+
     # Output logging messages for any failed matches
     if len(failed_matches) > 0:
         logger.error(f"{db_name}: Failed to find the genes in the annotation file ({mappingfile}): {', '.join(failed_matches)}")
 
     if len(failed_type_matches) > 0: 
-        failed_type_matches_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_type_matches.items()])
-        logger.warning(f"{db_name}: Did not figure out what type of annotations for:\n" + failed_type_matches_matches_string)
+        logger.warning(f"{db_name}: Did not figure out what type of annotations for:\n" + format_failed_targets(failed_type_matches))
 
     if len(failed_class_matches) > 0: 
-        ffiled_class_matches_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_class_matches.items()])
-        logger.warning(f"{db_name}: Did not figure out class annotations for:\n" + ffiled_class_matches_matches_string)
+        logger.warning(f"{db_name}: Did not figure out class annotations for:\n" + format_failed_targets(failed_class_matches))
     
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
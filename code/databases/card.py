@@ -7,17 +7,33 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 agg_funcs = {
-    'Drug Class': lambda x: ';'.join(x.unique()),
-    'DNA Accession': lambda x: ';'.join(x.unique()),
-    'Protein Accession': lambda x: ';'.join(x.unique()),
+    'Drug Class': lambda x: ';'.join(x.dropna().unique()),
+    'DNA Accession': lambda x: ';'.join(x.dropna().unique()),
+    'Protein Accession': lambda x: ';'.join(x.dropna().unique()),
     'CVTERM ID': 'first'
 }
 
 
-def add_card_annotations(file: str, onto: Ontology, logger, db_name: str = 'CARD'):
+def parse_card_annotations(file: str) -> dict:
+    """Parse the CARD annotation file. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    file : str
+        Path to the file containing CARD annotations
+
+    Returns
+    -------
+    dict
+        The CARD annotations aggregated with agg_funcs, keyed by ARO accession
+    """
+    card_annotations = pd.read_csv(file, sep='\t')
+    return card_annotations.groupby("ARO Accession").agg(agg_funcs).to_dict('index')
+
+def add_card_annotations(file: str, onto: Ontology, logger, db_name: str = 'CARD', parsed: dict = None):
     """Add CARD annotations to the ontology.
 
     Parameters
@@ -30,10 +46,12 @@ def add_card_annotations(file: str, onto: Ontology, logger, db_name: str = 'CARD
         Logger object for logging messages
     db_name : str, optional
         Name of the database, by default 'CARD'
+    parsed : dict, optional
+        Output of parse_card_annotations, parsed from file if not given, by default None
     """
 
     # load the CARD annotation file
-    card_annotations = pd.read_csv(file, sep='\t')
+    card_annotations = parse_card_annotations(file) if parsed is None else parsed
 
     # Compile a regular expression to match ARO numbers in the fasta headers
     p = re.compile(r"(ARO\:\d+)")
@@ -41,9 +59,9 @@ def add_card_annotations(file: str, onto: Ontology, logger, db_name: str = 'CARD
     # Find genes from the specified database in the ontology
     matched_genes = find_genes_from_database(onto, database_name=db_name)
 
-    # Lists for logging failed matches
+    # Lists for logging failed matches and for the target assignments
     failed_matches = []
-    failed_phenotype_matches = defaultdict(list)
+    assignments = []
 
     # Loop through matched pan_ genes and original gene names to add the annotations
     for gene, og in matched_genes.items():
@@ -54,45 +72,42 @@ def add_card_annotations(file: str, onto: Ontology, logger, db_name: str = 'CARD
 
         # check if there was a match
         if regex_match:
-            # Match the annotation data based on the ARO number
+            # Match the aggregated annotation data based on the ARO number
             aro_number = regex_match[0]
-            m = card_annotations.loc[card_annotations["ARO Accession"] == aro_number]
+            m = card_annotations.get(aro_number)
             
-            if m.shape[0] == 0:
+            if m is None:
                 # Log if no matches were found
                 failed_matches.append(f"{gene.name} ({og.name}, {aro_number})")
                 continue
-            
-            # Aggregate the metadata
-            m = m.groupby("ARO Accession").agg(agg_funcs).reset_index()
 
             # Extract the phenotypes and clean them
-            phenotypes = m['Drug Class'].item().replace('-like', '').split(';')
+            phenotypes = m['Drug Class'].replace('-like', '').split(';')
             
-            # Loop through phenotypes and add them to the ontology
+            # Loop through phenotypes and collect them for the ontology
             for phenotype in phenotypes:
                 phenotype = phenotype.strip().replace(' antibiotic', '').title()
-                success_match = gene_target(gene, og, target=phenotype, onto=onto, db_name=db_name)
-                if not success_match:
-                    failed_phenotype_matches[phenotype].append(f"{gene.name} ({og.name})")
+                assignments.append((gene, og, phenotype, db_name))
 
             # Add DNA accession number to the pan_ gene and the original gene name
-            dna_accessions = m['DNA Accession'].item().split(';')
+            dna_accessions = [dna_acc for dna_acc in m['DNA Accession'].split(';') if dna_acc]
             for dna_acc in dna_accessions:
                 gene.accession.append(dna_acc)
                 og.accession.append(dna_acc)
 
             # Add link to CARD information
-            card_url=f"https://card.mcmaster.ca/ontology/{m['CVTERM ID'].item()}"
+            card_url=f"https://card.mcmaster.ca/ontology/{m['CVTERM ID']}"
             gene.card_link.append(card_url)
     
+    # Add the phenotypes to the ontology
+    failed_phenotype_matches = apply_targets(assignments, onto=onto)
+
     # Output logging messages for any failed matches
     if len(failed_matches) > 0:
         logger.error(f"{db_name}: Failed to find the genes in the annotation file ({file}): {', '.join(failed_matches)}")    
 
     if len(failed_phenotype_matches):
-        failed_phenotype_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_phenotype_matches.items()])
-        logger.warning(f"{db_name}: Could not match phenotypes annotations for the following:\n" + failed_phenotype_matches_string)
+        logger.warning(f"{db_name}: Could not match phenotypes annotations for the following:\n" + format_failed_targets(failed_phenotype_matches))
     
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
@@ -7,7 +7,7 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 agg_funcs = {
     'antibiotic': lambda x: "/".join(x)
@@ -37,7 +37,23 @@ acr2ab = {
     'ZOL': 'Zoliflodacin',
 }
 
-def add_csabapal_annotations(file: str, onto: Ontology, logger, db_name: str = 'CsabaPal'):
+def parse_csabapal_annotations(file: str) -> dict:
+    """Parse the CsabaPal annotation file. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    file : str
+        Path to the CSV file containing the annotations
+
+    Returns
+    -------
+    dict
+        The CsabaPal annotations aggregated with agg_funcs, keyed by the unique ORF name
+    """
+    anno = pd.read_csv(file, sep=',')
+    return anno.groupby('orf_unique').agg(agg_funcs).to_dict('index')
+
+def add_csabapal_annotations(file: str, onto: Ontology, logger, db_name: str = 'CsabaPal', parsed: dict = None):
     """Add annotations from the Darkua, et al. (2025) paper to the ontology
 
     Parameters
@@ -50,6 +66,8 @@ def add_csabapal_annotations(file: str, onto: Ontology, logger, db_name: str = '
         Logger object for logging messages
     db_name : str, optional
         Name of the database, by default 'CsabaPal'
+    parsed : dict, optional
+        Output of parse_csabapal_annotations, parsed from file if not given, by default None
 
     References
     ----------
@@ -57,24 +75,29 @@ def add_csabapal_annotations(file: str, onto: Ontology, logger, db_name: str = '
     """
 
     # Load the annotation file
-    anno = pd.read_csv(file, sep=',')
+    anno = parse_csabapal_annotations(file) if parsed is None else parsed
 
     # Find the genes from the specified database in the ontology
     matched_genes = find_genes_from_database(onto, database_name=db_name)
 
-    # Lists for storing failed matches
+    # Lists for storing failed matches and the target assignments
+    failed_gene_matches = []
     failed_matches = defaultdict(list)
-    failed_ab_matches = defaultdict(list)
+    assignments = []
 
     # Loop through each matched gene and add the annotations to it
     for gene, og in matched_genes.items():
 
-        # Match the annotation data based on the original gene name
-        m = anno.loc[anno['orf_unique'] == og.name,]
-        m = m.groupby('orf_unique').agg(agg_funcs).reset_index()
+        # Match the aggregated annotation data based on the original gene name
+        m = anno.get(og.name)
+
+        # Log if no matches were found
+        if m is None:
+            failed_gene_matches.append(f"{gene.name} ({og.name})")
+            continue
         
         # Loop through the acronyms for the antibiotics used in the study
-        for ab_short in m['antibiotic'].item().split('/'):
+        for ab_short in m['antibiotic'].split('/'):
             ab = acr2ab.get(ab_short, None)
 
             # Log if no translation found
@@ -82,20 +105,21 @@ def add_csabapal_annotations(file: str, onto: Ontology, logger, db_name: str = '
                 failed_matches[ab].append(f"{gene.name} ({og.name})")
                 continue
 
-            # Add it to the ontology
-            success_match = gene_target(gene, og, target=ab, onto = onto, db_name = db_name)
-
-            # Log if not found in the targets master table
-            if not success_match:
-                failed_ab_matches[ab].append(f"{gene.name} ({og.name})")
+            # Collect it for the ontology
+            assignments.append((gene, og, ab, db_name))
     
+    # Add the antibiotics to the ontology, failures were not found in the targets master table
+    failed_ab_matches = apply_targets(assignments, onto=onto)
+
     # Output logging messages for any failed matches            
+    if len(failed_gene_matches) > 0:
+        logger.error(f"{db_name}: Failed to find the genes in the annotation file ({file}): {', '.join(failed_gene_matches)}")
+
     if len(failed_matches) > 0:
         logger.error(f"{db_name}: Failed to find acronyms translations for: {', '.join(failed_matches)}")    
     
     if len(failed_ab_matches) > 0:
-        failed_ab_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k, v in failed_ab_matches.items()])
-        logger.warning(f"{db_name}: Failed to find the annotations for the following antibiotics:\n" + failed_ab_matches_string)
+        logger.warning(f"{db_name}: Failed to find the annotations for the following antibiotics:\n" + format_failed_targets(failed_ab_matches))
     
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
\ No newline at end of file
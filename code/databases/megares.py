@@ -5,8 +5,8 @@ from collections import defaultdict
 
 import sys
 sys.path.append('..')
-from functions import find_genes_from_database, get_instance
-from targets import gene_target
+from functions import find_genes_from_database, get_instance, register_gene_database
+from targets import apply_targets, format_failed_targets
 
 megares2class = {
     'Betalactam': 'Beta-Lactam',
@@ -28,7 +28,47 @@ extra_approved_databases = [
      'BacMet'
 ]
 
-def add_megares_annotations(onto: Ontology, mappingfile: str, logger, db_name: str = 'MegaRes'):
+def parse_megares_annotations(mappingfile: str) -> dict:
+    """Parse the MEGARes header mapping file into a prefix index. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    mappingfile : str
+        Path to the file containing MEGARes annotations
+
+    Returns
+    -------
+    dict
+        (MEGARes header, original database) tuples keyed by the first field of the MEGARes header
+    """
+    megares_mappings = pd.read_csv(mappingfile, on_bad_lines='warn', sep=';')
+
+    # Index the headers on their first field, headers without fields can never be matched
+    prefix_index = defaultdict(list)
+    for header, database in zip(megares_mappings['MEGARes_header'], megares_mappings['Database']):
+        if isinstance(header, str) and '|' in header:
+            prefix_index[header.split('|', 1)[0]].append((header, database))
+    return dict(prefix_index)
+
+def find_megares_original(prefix_index: dict, gene_name: str) -> list:
+    """Find the mappings whose MEGARes header starts with the gene name as its first field(s)
+
+    Parameters
+    ----------
+    prefix_index : dict
+        Output of parse_megares_annotations
+    gene_name : str
+        The original MEGARes gene name
+
+    Returns
+    -------
+    list
+        The matching (MEGARes header, original database) tuples
+    """
+    candidates = prefix_index.get(gene_name.split('|', 1)[0], [])
+    return [c for c in candidates if c[0].startswith(gene_name + '|')]
+
+def add_megares_annotations(onto: Ontology, mappingfile: str, logger, db_name: str = 'MegaRes', parsed: dict = None):
     """Add MegaRes annotations to the ontology
 
     Parameters
@@ -41,17 +81,19 @@ def add_megares_annotations(onto: Ontology, mappingfile: str, logger, db_name: s
         Logging object for logging messages
     db_name : str, optional
         Name of the database, by default 'MegaRes'
+    parsed : dict, optional
+        Output of parse_megares_annotations, parsed from mappingfile if not given, by default None
     """
     
     # Read the annotation file
-    megares_mappings = pd.read_csv(mappingfile, on_bad_lines='warn', sep=';')
+    megares_prefix_index = parse_megares_annotations(mappingfile) if parsed is None else parsed
     
     # Find the genes from the specified database in the ontology
     matched_genes = find_genes_from_database(onto, database_name=db_name)
 
     # Lists for storing failed matches
     failed_class_matches = defaultdict(list)
-    failed_type_matches = defaultdict(list)
+    assignments = []
 
     # Compile a regular expression to clean resistance class names
     p = re.compile(r"_resistance|\sresistance|_|s$")
@@ -72,17 +114,18 @@ def add_megares_annotations(onto: Ontology, mappingfile: str, logger, db_name: s
         for resistance_class in resistance_classes.split('/'):
             if resistance_class in to_skip: 
                 continue
-            success_match = gene_target(gene, og, target=resistance_class, onto=onto, db_name=db_name)
-            # log if no match
-            if not success_match:
-                    failed_type_matches[resistance_class].append(f"{gene.name} ({og.name})")
+            assignments.append((gene, og, resistance_class, db_name))
             
         # Get the original database from which MEGARes pulled the genes
-        megares_original = megares_mappings.loc[megares_mappings['MEGARes_header'].fillna('').str.startswith(og.name + '|')]
-        if megares_original.shape[0]  == 1 and megares_original['Database'].item() in extra_approved_databases:
-            megares_original_db_instance = get_instance(onto = onto, name = megares_original['Database'].item())
+        megares_original = find_megares_original(megares_prefix_index, og.name)
+        if len(megares_original) == 1 and megares_original[0][1] in extra_approved_databases:
+            megares_original_db_instance = get_instance(onto = onto, name = megares_original[0][1])
             og.is_from_database.append(megares_original_db_instance)
             gene.is_from_database.append(megares_original_db_instance)
+            register_gene_database(gene, og, megares_original_db_instance)
+
+    # Add the resistance classes to the ontology
+    failed_type_matches = apply_targets(assignments, onto=onto)
 
     # Output logging messages for any failed matches        
     if len(failed_class_matches) > 0: 
@@ -90,8 +133,7 @@ def add_megares_annotations(onto: Ontology, mappingfile: str, logger, db_name: s
         logger.warning(f"{db_name}: Did not match the following to any type of resistance annotation:\n" + failed_class_matches_string)
     
     if len(failed_type_matches) > 0: 
-        failed_type_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_type_matches.items()])
-        logger.warning(f"{db_name}: Did not figure out what type of annotations for:\n" + failed_type_matches_string)
+        logger.warning(f"{db_name}: Did not figure out what type of annotations for:\n" + format_failed_targets(failed_type_matches))
     
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
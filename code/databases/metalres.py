@@ -7,7 +7,7 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 metal2metal = {
     'Zink': 'Zinc',
@@ -33,9 +33,9 @@ def add_metalres_annotations(onto: Ontology, logger, db_name: str = 'MetalRes'):
     # Compile a regular expression to match metal resistance in fasta headers
     p = re.compile(r"\s(\S+)\sresistance")
 
-    # Lists for storing failed matches
-    failed_class_matches = defaultdict(list)
+    # Lists for storing failed matches and the target assignments
     failed_type_matches = defaultdict(list)
+    assignments = []
 
     # Loop through each matched gene and add annotations
     for gene, og in matched_genes.items():
@@ -49,11 +49,7 @@ def add_metalres_annotations(onto: Ontology, logger, db_name: str = 'MetalRes'):
             metals = m[0].split('/')
             for metal in metals:
                 metal = metal2metal.get(metal, metal)
-                success_match = gene_target(gene=gene, og=og, target=metal, onto=onto, db_name=db_name)
-
-                # log if no successful matching
-                if not success_match:
-                    failed_class_matches[metal].append(f"{gene.name} ({og.name})")
+                assignments.append((gene, og, metal, db_name))
         # log if no metal could be found in the fasta header
         else:
             failed_type_matches[metal].append(f"{gene.name} ({og.name})")
@@ -63,10 +59,12 @@ def add_metalres_annotations(onto: Ontology, logger, db_name: str = 'MetalRes'):
         gene.accession.append(accession)
         og.accession.append(accession)
     
+    # Add the metals to the ontology
+    failed_class_matches = apply_targets(assignments, onto=onto)
+
     # Output logging messages for any failed matches
     if len(failed_class_matches) > 0: 
-        failed_class_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_class_matches.items()])
-        logger.warning(f"{db_name}: Did not match the following to any type of resistance annotation:\n" + failed_class_matches_string)
+        logger.warning(f"{db_name}: Did not match the following to any type of resistance annotation:\n" + format_failed_targets(failed_class_matches))
     
     if len(failed_type_matches) > 0: 
         failed_type_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_type_matches.items()])
@@ -1,14 +1,17 @@
 from turtle import left
 import pandas as pd
 from owlready2 import *
-import subprocess
 from loguru import logger
 
 import sys
 sys.path.append('..')
-from functions import get_instance, clean_gene_name, get_or_create_instance
+from functions import get_instance, clean_gene_name, get_or_create_instance, register_gene_database
+from readers import read_fasta_headers, read_cdhit_clusters, CdhitTableWriter
+from contextlib import nullcontext
 import re
 import os
+from itertools import groupby
+from operator import itemgetter
 
 database2name = {
     'amrfinderplus': 'AMRFinderPlus',
@@ -84,37 +87,54 @@ def add_panres_genes(file: str, onto: Ontology, discarded: str, logger = logger)
     # Remove discarded genes from the metadata
     panres_metadata = panres_metadata[~panres_metadata['userGeneName'].isin(discarded_genes_list)]
     
-    # Get a list of the unique gene names
+    # Sort the metadata by gene, keeping the order of the entries of each gene
+    panres_metadata = panres_metadata.sort_values('userGeneName', kind='stable')
     genes = panres_metadata['userGeneName'].unique().tolist()
-    # genes = panres_metadata.loc[panres_metadata['database'] == 'resfinder', 'userGeneName'].unique().tolist()
-    
-    # Loop through each unique gene, add it to the ontology and its annotations
-    for gene in set(genes):
 
-        # Get annotation data for the correct gene
-        m = panres_metadata.loc[panres_metadata['userGeneName'] == gene, ]
+    # Get the gene lengths and check if they are consistent across all entries of a gene
+    gene_lengths = panres_metadata.groupby('userGeneName', sort=False)['gene_len'].agg(['nunique', 'first'])
+
+    # Resolve the database and cluster instances once
+    database_instances = {
+        database_shortname: get_instance(onto, database2name[database_shortname.lower()])
+        for database_shortname in panres_metadata['database'].unique()
+    }
+    cluster_instances = {}
+
+    # Group the annotation data by gene in a single pass over the sorted rows
+    rows = zip(
+        panres_metadata['userGeneName'], 
+        panres_metadata['database'], 
+        panres_metadata['fa_header'], 
+        panres_metadata['chosenSeq']
+    )
+
+    # Loop through each unique gene, add it to the ontology and its annotations
+    for gene, m in groupby(rows, key=itemgetter(0)):
         
         # Make new PanGene instance
         new_gene = onto.PanGene(gene)
 
         # add the gene length if its consistent across all entries
-        if m['gene_len'].nunique() == 1:
-            new_gene.has_length.append(int(m['gene_len'].values[0]))
+        if gene_lengths.at[gene, 'nunique'] == 1:
+            new_gene.has_length.append(int(gene_lengths.at[gene, 'first']))
         else:
             logger.warning(f"PanRes: {gene} has multiple gene lengths associated.")
         
+        # Collect the links of the gene, to set them at once
+        gene_databases, gene_original_names, gene_clusters = {}, {}, {}
+
         # Loop through the annotation data for this gene
-        for _, row in m.iterrows():
+        for _, database_shortname, fa_header, chosen_seq in m:
             # Map the full database name from the short name
-            database_shortname = row['database']
             database_name = database2name[database_shortname.lower()]
             
             # Get the instance and link the original gene name to the database
-            database_instance = get_instance(onto, database_name)
-            new_gene.is_from_database.append(database_instance)
+            database_instance = database_instances[database_shortname]
+            gene_databases[database_instance] = None
 
             # Clean and format the fasta header
-            fasta_header = row['fa_header'].replace("~~~", "|").replace("'", "")
+            fasta_header = fa_header.replace("~~~", "|").replace("'", "")
             gene_name = clean_gene_name(fasta_header, database_shortname.lower()).strip()
 
             # Add the cleaned gene name as an individual of the class OriginalGene
@@ -125,36 +145,43 @@ def add_panres_genes(file: str, onto: Ontology, discarded: str, logger = logger)
             original_gene_instance.original_fasta_header.append(fasta_header.strip() + '|' + database_name)
 
             # Annotate that the pan gene name is the same as the original gene name
-            new_gene.same_as.append(original_gene_instance)
+            gene_original_names[original_gene_instance] = None
+            register_gene_database(new_gene, original_gene_instance, database_instance)
 
             # Get which cluster the gene belongs to 
-            new_cluster = get_or_create_instance(onto = onto, cls = onto.PanGeneCluster, name=row['chosenSeq'].replace('pan', 'panc'))
-            new_gene.member_of.append(new_cluster)
+            cluster_name = chosen_seq.replace('pan', 'panc')
+            if cluster_name not in cluster_instances:
+                cluster_instances[cluster_name] = get_or_create_instance(onto = onto, cls = onto.PanGeneCluster, name=cluster_name)
+            gene_clusters[cluster_instances[cluster_name]] = None
+
+        new_gene.is_from_database.extend(gene_databases)
+        new_gene.same_as.extend(gene_original_names)
+        new_gene.member_of.extend(gene_clusters)
     
     # logger.info(f"Adding {len(genes)} PanRes genes to the ontology.")
     logger.success(f"Added PanRes genes (n={len(genes)}) to the ontology.")
 
-def add_panres_proteins(file: str, clstrs: str, onto: Ontology, logger):
+def add_panres_proteins(file: str, clstrs: str, onto: Ontology, logger, cluster_table: str = None):
     """Adds PanRes proteins and their clusters to the ontology.
 
     Parameters
     ----------
     file : str
-        Path to the faa file containing PanRes protein sequences.
+        Path to the faa file containing PanRes protein sequences, optionally gzip-compressed.
     clstrs : str
         Path to the clstr file containing PanRes protein clusters, as determined by CD-HIT.
     onto : Ontology
         The ontology to load the protein information into
     logger : loguru.logger
         Logger object for logging messages
+    cluster_table : str, optional
+        Path prefix to write the protein cluster-membership table to, by default None (not written).
+        See `readers.CdhitTableWriter`.
     """
 
-    # Grep all headers of the protein sequences and extract them
-    p = subprocess.run(f"grep '>' {file}", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    protein_names = [l.split('_v1')[0].replace(">", "") for l in p.stdout.decode().split()]
-
-    # Loop through the protein names and add to the ontology
-    for protein_name in protein_names:
+    # Stream the headers of the protein sequences and loop through the protein names to add to the ontology
+    for header in read_fasta_headers(file):
+        protein_name = header.split(None, 1)[0].split('_v1')[0]
         protein_instance = get_or_create_instance(onto = onto, cls = onto.PanProtein, name=protein_name.title())
 
         # Get the corresponding gene cluster instance and link the protein name to it
@@ -165,38 +192,35 @@ def add_panres_proteins(file: str, clstrs: str, onto: Ontology, logger):
     # Log the successfull addition  of proteins
     logger.success("Added PanRes proteins to the ontology.")
 
-    # Read the CD-HIT output file to extract cluster information
-    p = re.compile(r">(pan\_\d+)")
-    clusters = defaultdict(list)
-    cluster_representative = None
-    members = []
-    with open(clstrs, 'r') as f:
-        for l in f.readlines():
-            l = l.strip()
-            m = p.findall(l)
-
-            # Check if the line indicates a new cluster
-            if l.startswith('>Cluster'):
-                if cluster_representative is not None:
-                    clusters[cluster_representative] = members
-                    members, cluster_representative = [], None
-            # Else identify the cluster representative and it to the member list
-            elif m and l.endswith('*'):
-                cluster_representative = m[0]
-                members.append(m[0])
-            # Add members to the current cluster
-            else:
-                members.append(m[0])
-
-    # Loop through each cluster and add it to the ontology
-    for cl, cl_members in clusters.items():
-        cluster_protein_instance = get_or_create_instance(onto = onto, cls = onto.PanProteinCluster, name=cl.replace('pan', 'Pan'))
-
-        # Link each protein member to its cluster representative
-        for cl_member in cl_members:
-            cl_instance = get_or_create_instance(onto = onto, cls = onto.PanProtein, name = cl_member.title())
-            if cl_instance is not None:
-                cl_instance.member_of.append(cluster_protein_instance)
-        
+    # Write the cluster memberships as a table that can be memory-mapped by downstream tools, from the same stream
+    if cluster_table is not None:
+        os.makedirs(os.path.dirname(cluster_table) or '.', exist_ok=True)
+
+    # Stream the clusters from the CD-HIT output file and add them to the ontology
+    p = re.compile(r"(pan\_\d+)")
+    n_clusters = 0
+    with CdhitTableWriter(cluster_table) if cluster_table is not None else nullcontext() as table:
+        for representative, members, lengths, identities in read_cdhit_clusters(clstrs):
+            if table is not None:
+                table.add(representative, members, lengths, identities)
+
+            # Skip clusters without a PanRes representative
+            m = p.match(representative) if representative is not None else None
+            if m is None:
+                continue
+            cluster_protein_instance = get_or_create_instance(onto = onto, cls = onto.PanProteinCluster, name=m.group(1).replace('pan', 'Pan'))
+
+            # Link each protein member to its cluster representative, skipping members that are not PanRes proteins
+            for member in members:
+                m = p.match(member)
+                if m is None:
+                    continue
+                cl_instance = get_or_create_instance(onto = onto, cls = onto.PanProtein, name = m.group(1).title())
+                if cl_instance is not None:
+                    cl_instance.member_of.append(cluster_protein_instance)
+            n_clusters += 1
+
     # Log the successful addition of protein clusters
-    logger.success("Added PanRes protein clusters to the ontology.")
+    logger.success(f"Added PanRes protein clusters (n={n_clusters}) to the ontology.")
+    if cluster_table is not None:
+        logger.info(f"Wrote PanRes protein cluster table to {cluster_table}.clusters.npy.")
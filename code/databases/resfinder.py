@@ -8,7 +8,7 @@ import re
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 agg_funcs = {
     'Class': lambda x: ', '.join(x.unique()),
@@ -19,7 +19,30 @@ agg_funcs = {
 
 class2class = {'Ionophores': 'Ionophore'}
 
-def add_resfinder_annotations(file: str, onto: Ontology, logger, db_name: str = 'ResFinder'):
+def parse_resfinder_annotations(file: str) -> dict:
+    """Parse and clean the ResFinder annotation file. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    file : str
+        Path to the file containing ResFinder annotations
+
+    Returns
+    -------
+    dict
+        The cleaned ResFinder annotations aggregated with agg_funcs, keyed by gene accession
+    """
+
+    # Load the annotation file
+    resfinder_annotations = pd.read_csv(file, sep='\t')
+
+    # Clean strings
+    resfinder_annotations['Gene_accession no.'] = resfinder_annotations['Gene_accession no.'].str.replace("'", "")
+    string_columns = resfinder_annotations.select_dtypes(include='object').columns
+    resfinder_annotations[string_columns] = resfinder_annotations[string_columns].replace(['nan'], np.nan).fillna('')
+    return resfinder_annotations.groupby('Gene_accession no.').agg(agg_funcs).to_dict('index')
+
+def add_resfinder_annotations(file: str, onto: Ontology, logger, db_name: str = 'ResFinder', parsed: dict = None):
     """Add ResFinder annotations to the ontology.
 
     Parameters
@@ -32,87 +55,74 @@ def add_resfinder_annotations(file: str, onto: Ontology, logger, db_name: str =
         Logger object for logging messages.
     db_name : str, optional
         Name of the database, by default 'ResFinder'
+    parsed : dict, optional
+        Output of parse_resfinder_annotations, parsed from file if not given, by default None
     """
 
     # Load the annotation file
-    resfinder_annotations = pd.read_csv(file, sep='\t')
-
-    # Clean strings
-    resfinder_annotations['Gene_accession no.'] = resfinder_annotations['Gene_accession no.'].str.replace("'", "")
-    string_columns = resfinder_annotations.select_dtypes(include='object').columns
-    resfinder_annotations[string_columns] = resfinder_annotations[string_columns].replace(['nan'], np.nan).fillna('')
+    resfinder_annotations = parse_resfinder_annotations(file) if parsed is None else parsed
 
-    # Lists for storing failed matches
+    # Lists for storing failed matches and the target assignments
     failed_matches = [] 
-    failed_class_matches = defaultdict(list)
-    failed_phenotype_matches = defaultdict(list)
-    failed_mechanism_matches = defaultdict(list)
+    class_assignments = []
+    phenotype_assignments = []
+    mechanism_assignments = []
 
     # Find genes from the specified database in the ontology
     matched_genes = find_genes_from_database(onto, database_name=db_name)
 
     # Loop through each matched gene and add annotations
     for gene, og in matched_genes.items():
-        # Match the annotation data based on the gene accession number
-        m = resfinder_annotations.loc[resfinder_annotations['Gene_accession no.'] == og.name]
-        m = m.groupby('Gene_accession no.').agg(agg_funcs).reset_index()
+        # Match the aggregated annotation data based on the gene accession number
+        m = resfinder_annotations.get(og.name)
 
         # Log failed matches
-        if m.shape[0] == 0:
+        if m is None:
             failed_matches.append(f"{gene.name} ({og.name})")
             continue
         
         # Get class annotations and clean them a bit
-        ab_classes = m['Class'].item().replace(" Unknown", "").title()
+        ab_classes = m['Class'].replace(" Unknown", "").title()
 
         for ab_class in ab_classes.split(','):
             ab_class = ab_class.strip()
-            success_match = gene_target(gene, og, target=class2class.get(ab_class,ab_class), onto=onto, db_name=db_name)
-            # log if failed match
-            if not success_match:
-                failed_class_matches[ab_class].append(f"{gene.name} ({og.name})")
+            class_assignments.append((gene, og, class2class.get(ab_class,ab_class), db_name, ab_class))
 
         # Get phenotype annotations and clean them
-        phenotypes = m['Phenotype'].item().split(',') 
+        phenotypes = m['Phenotype'].split(',') 
         for phenotype in set(phenotypes):
             phenotype = phenotype.replace('Unknown', '').strip().title()
             phenotype = re.sub(r"s$", "", phenotype)
-            success_match = gene_target(gene, og, target=phenotype, onto=onto, db_name=db_name)
-
-            # log if failed match
-            if not success_match:
-                failed_phenotype_matches[phenotype].append(f"{gene.name} ({og.name})")
+            phenotype_assignments.append((gene, og, phenotype, db_name))
         
         # Get mechanisms of resistance and clean them
-        mechanisms = m['Mechanism of resistance'].item().split(',')
+        mechanisms = m['Mechanism of resistance'].split(',')
         for mechanism in set(mechanisms):
             mechanism = mechanism.strip().title()
-            success_match = gene_target(gene, og, target=mechanism, onto=onto, db_name=db_name)
-
-            # log if failed match
-            if not success_match:
-                failed_mechanism_matches[mechanism].append(f"{gene.name} ({og.name})")  
+            mechanism_assignments.append((gene, og, mechanism, db_name))
 
         # Add DNA accession
         dna_acc = og.name.split('_')[-1].replace(f"|{db_name}", "")
         gene.accession.append(dna_acc)
         og.accession.append(dna_acc)
     
+    # Add the classes, phenotypes and mechanisms to the ontology
+    failed_class_matches = apply_targets(class_assignments, onto=onto)
+    failed_phenotype_matches = apply_targets(phenotype_assignments, onto=onto)
+    failed_mechanism_matches = apply_targets(mechanism_assignments, onto=onto)
+
     # Output logging messages for any failed matches
     if len(failed_matches) > 0:
         logger.error(f"{db_name}: Failed to find the genes in the annotation file ({file}): {', '.join(failed_matches)}")    
     
     if len(failed_class_matches) > 0:
-        failed_class_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_class_matches.items()])
-        logger.warning(f"{db_name}: Failed to find classes for the following annotations:\n" + failed_class_matches_string)
+        logger.warning(f"{db_name}: Failed to find classes for the following annotations:\n" + format_failed_targets(failed_class_matches))
 
     if len(failed_phenotype_matches) > 0:
-        failed_phenotype_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_phenotype_matches.items()])
-        logger.warning(f"{db_name}: Failed to find phenotypes for the following annotations:\n" + failed_phenotype_matches_string)
+        logger.warning(f"{db_name}: Failed to find phenotypes for the following annotations:\n" + format_failed_targets(failed_phenotype_matches))
     
     if len(failed_mechanism_matches) > 0:
-        failed_mechanism_matches_string = "\n".join([f"{k}: {', '.join(v)}" for k,v in failed_mechanism_matches.items()])
-        logger.warning(f"{db_name}: Failed to find mechanisms for the following annotations:\n" + failed_mechanism_matches_string)
+        logger.warning(f"{db_name}: Failed to find mechanisms for the following annotations:\n" + format_failed_targets(failed_mechanism_matches))
     
 
     # Log the successful addition of annotations
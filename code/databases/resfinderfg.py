@@ -5,7 +5,7 @@ from collections import defaultdict
 import sys
 sys.path.append('..')
 from functions import find_genes_from_database
-from targets import gene_target
+from targets import apply_targets, format_failed_targets
 
 # Missing acronyms:
 # SMZ: pan_19 (KY705325.1) 
@@ -58,7 +58,31 @@ fg2class = {
 
 }
 
-def add_resfinderfg_annotations(file: str, onto: Ontology, logger, db_name: str = 'ResFinderFG'):
+def parse_resfinderfg_annotations(file: str) -> dict:
+    """Parse the acronym translations of the ResFinderFG annotation file. Does not use the ontology, so it can run in a separate process.
+
+    Parameters
+    ----------
+    file : str
+        Path to the file containing ResFinderFG annotations
+
+    Returns
+    -------
+    dict
+        Acronym translations, completed with the manual translations in fg2class
+    """
+    
+    # Load the annotations by parsing the text file
+    translations = dict(fg2class)
+    with open(file, 'r') as f:
+        lines = [l.strip() for l in f.readlines()]
+    for l in lines:
+        ll = l.split(':')
+        if len(ll) == 2:
+            translations[ll[0].strip()]=ll[1].strip()
+    return translations
+
+def add_resfinderfg_annotations(file: str, onto: Ontology, logger, db_name: str = 'ResFinderFG', parsed: dict = None):
     """Add ResFinderFG annotations to the ontology.
 
     Parameters
@@ -71,18 +95,15 @@ def add_resfinderfg_annotations(file: str, onto: Ontology, logger, db_name: str
         Logger object for logging messages.
     db_name : str, optional
         Name of the database, by default 'ResFinderFG'
+    parsed : dict, optional
+        Output of parse_resfinderfg_annotations, parsed from file if not given, by default None
     """
     
-    # Load the annotations by parsing the text file
-    with open(file, 'r') as f:
-        lines = [l.strip() for l in f.readlines()]
-    for l in lines:
-        ll = l.split(':')
-        if len(ll) == 2:
-            fg2class[ll[0].strip()]=ll[1].strip()
+    # Load the acronym translations
+    translations = parse_resfinderfg_annotations(file) if parsed is None else parsed
 
-    # Lists for storing failed acronym matches
-    failed_acronym_matches = defaultdict(list)
+    # List for storing the target assignments
+    assignments = []
     
     # Find genes from the specified database in the ontology
     matched_genes = find_genes_from_database(onto, database_name=db_name)
@@ -92,23 +113,22 @@ def add_resfinderfg_annotations(file: str, onto: Ontology, logger, db_name: str
         # Extract and clean the fasta header for the current gene
         fasta_header = og.original_fasta_header[0].replace(f"|{db_name}", "")
         ab_class_acronym = fasta_header.split('|')[-1]
-        ab_class_name = fg2class.get(ab_class_acronym, ab_class_acronym).title()
+        ab_class_name = translations.get(ab_class_acronym, ab_class_acronym).title()
 
-        # Add resistance links
-        success_match = gene_target(gene, og, target=ab_class_name, onto=onto, db_name=db_name)
-        # log if no match
-        if not success_match:
-            failed_acronym_matches[ab_class_acronym].append(f"{gene.name} ({og.name})")
+        # Collect resistance links
+        assignments.append((gene, og, ab_class_name, db_name, ab_class_acronym))
 
         # Add accession numbers
         dna_acc = fasta_header.split('|')[1]
         gene.accession.append(dna_acc)
         og.accession.append(dna_acc)
     
+    # Add the resistance links to the ontology
+    failed_acronym_matches = apply_targets(assignments, onto=onto)
+
     # Output logging messages for any failed matches
     if len(failed_acronym_matches) > 0:
-        failed_acronym_matches_string = "\n".join([f"{k}: {','.join(v)}" for k,v in failed_acronym_matches.items()])
-        logger.warning(f"{db_name}: Failed to find acronym translations for:\n" + failed_acronym_matches_string)
+        logger.warning(f"{db_name}: Failed to find acronym translations for:\n" + format_failed_targets(failed_acronym_matches))
     
     # Log the successful addition of annotations
     logger.success(f"Added {db_name} annotations to the PanRes ontology.")
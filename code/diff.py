@@ -0,0 +1,278 @@
+import os
+import sqlite3
+import hashlib
+import argparse
+import pandas as pd
+from loguru import logger
+from owlready2.rdfxml_2_ntriples import parse as parse_rdfxml
+from readers import is_quadstore
+
+rdf_type_iri = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+xsd_string_iri = "http://www.w3.org/2001/XMLSchema#string"
+owl_named_individual_iri = "http://www.w3.org/2002/07/owl#NamedIndividual"
+
+# Prefixes used to shorten the IRIs in the output tables
+prefixes = {
+    'panres': "http://genepi.dk/PanResOntology.owl#",
+    'rdf': "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    'rdfs': "http://www.w3.org/2000/01/rdf-schema#",
+    'owl': "http://www.w3.org/2002/07/owl#",
+    'xsd': "http://www.w3.org/2001/XMLSchema#",
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare two versions of the ontology and list the added, removed and changed entities and triples')
+
+    parser.add_argument(
+        '-a', '--old',
+        type=str,
+        required=True,
+        help='Path to the old version, an ontology file (.owl) or a quadstore (.sqlite3)',
+        dest='old'
+    )
+    parser.add_argument(
+        '-b', '--new',
+        type=str,
+        required=True,
+        help='Path to the new version, an ontology file (.owl) or a quadstore (.sqlite3)',
+        dest='new'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        required=True,
+        help='Directory to write the differences to (entities.tsv and triples.tsv)',
+        dest='output'
+    )
+    parser.add_argument(
+        '--buckets',
+        type=int,
+        default=65536,
+        help='Number of hash buckets the subjects are divided into, more buckets load fewer unchanged triples',
+        dest='buckets'
+    )
+
+    return parser.parse_args()
+
+def literal(value, datatype: str) -> tuple:
+    """Get the lexical form and datatype of a literal, treating plain literals as xsd:string
+
+    Parameters
+    ----------
+    value
+        The value of the literal
+    datatype : str
+        IRI of the datatype, or the language tag starting with '@'
+
+    Returns
+    -------
+    tuple
+        The lexical form and the datatype
+    """
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return str(value), datatype or xsd_string_iri
+
+def read_triples(file: str, on_triple):
+    """Stream the triples of an ontology file or quadstore, without loading the ontology
+
+    Literals are given by their lexical form and datatype, so triples read from an OWL file and
+    from a quadstore compare equal. Triples involving blank nodes (restrictions and
+    disjointness axioms) are left out, as their identifiers are not stable between versions.
+
+    Parameters
+    ----------
+    file : str
+        Path to the ontology file (.owl) or the quadstore (.sqlite3)
+    on_triple : callable
+        Function called as ``on_triple(s, p, o, d)`` for each triple, d is the datatype of a
+        literal object and '' for an entity
+    """
+    if is_quadstore(file):
+        db = sqlite3.connect(f"file:{os.path.abspath(file)}?mode=ro", uri=True)
+        try:
+            # Blank nodes have negative storids and no IRI, the joins leave them out
+            for s, p, o in db.execute(
+                """SELECT DISTINCT rs.iri, rp.iri, ro.iri FROM objs q
+                JOIN resources rs ON rs.storid = q.s JOIN resources rp ON rp.storid = q.p JOIN resources ro ON ro.storid = q.o"""
+            ):
+                on_triple(s, p, o, '')
+
+            for s, p, o, d, datatype in db.execute(
+                """SELECT DISTINCT rs.iri, rp.iri, q.o, q.d, rd.iri FROM datas q
+                JOIN resources rs ON rs.storid = q.s JOIN resources rp ON rp.storid = q.p LEFT JOIN resources rd ON rd.storid = q.d"""
+            ):
+                on_triple(s, p, *literal(o, d if isinstance(d, str) else datatype))
+        finally:
+            db.close()
+        return
+
+    def on_obj(s, p, o):
+        if not (s.startswith('_') or o.startswith('_')):
+            on_triple(s, p, o, '')
+
+    def on_data(s, p, o, d):
+        if not s.startswith('_'):
+            on_triple(s, p, *literal(o, d))
+
+    with open(file, 'rb') as f:
+        parse_rdfxml(f, on_obj, on_data)
+
+def triple_hash(s: str, p: str, o: str, d: str) -> int:
+    """64-bit hash of a triple"""
+    return int.from_bytes(hashlib.blake2b(f"{s}\t{p}\t{o}\t{d}".encode(), digest_size=8).digest(), 'little')
+
+def subject_bucket(s: str, buckets: int) -> int:
+    """Hash bucket of the subject of a triple"""
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'little') % buckets
+
+def bucket_digests(file: str, buckets: int) -> tuple:
+    """Compute an order-independent digest of the triples in each subject bucket
+
+    The digest of a bucket is the sum of the hashes of its triples (modulo 2^64) together with
+    their number, so two versions only need to be compared triple by triple in the buckets
+    whose digests differ.
+
+    Parameters
+    ----------
+    file : str
+        Path to the ontology file or quadstore
+    buckets : int
+        Number of buckets
+
+    Returns
+    -------
+    tuple
+        Lists of the hash sums and the number of triples per bucket
+    """
+    sums = [0] * buckets
+    counts = [0] * buckets
+    last_subject, bucket = None, None
+
+    def on_triple(s, p, o, d):
+        nonlocal last_subject, bucket
+        # Triples of the same subject mostly come in a row
+        if s != last_subject:
+            last_subject, bucket = s, subject_bucket(s, buckets)
+        sums[bucket] = (sums[bucket] + triple_hash(s, p, o, d)) & 0xFFFFFFFFFFFFFFFF
+        counts[bucket] += 1
+
+    read_triples(file, on_triple)
+    return sums, counts
+
+def bucket_triples(file: str, buckets: int, selected: set) -> dict:
+    """Collect the triples of the subjects in the selected buckets
+
+    Parameters
+    ----------
+    file : str
+        Path to the ontology file or quadstore
+    buckets : int
+        Number of buckets
+    selected : set
+        The buckets to collect the triples of
+
+    Returns
+    -------
+    dict
+        Sets of (predicate, object, datatype) tuples keyed by subject
+    """
+    triples = {}
+    last_subject, bucket = None, None
+
+    def on_triple(s, p, o, d):
+        nonlocal last_subject, bucket
+        if s != last_subject:
+            last_subject, bucket = s, subject_bucket(s, buckets)
+        if bucket in selected:
+            triples.setdefault(s, set()).add((p, o, d))
+
+    read_triples(file, on_triple)
+    return triples
+
+def compact(term: str) -> str:
+    """Shorten an IRI or datatype with the known prefixes"""
+    for prefix, iri in prefixes.items():
+        if term.startswith(iri):
+            return f"{prefix}:{term[len(iri):]}"
+    return term
+
+def diff_ontologies(old: str, new: str, buckets: int = 65536) -> tuple:
+    """Find the entities and triples that differ between two versions of the ontology
+
+    Both versions are streamed twice: once to compute the digests of the subject buckets, and
+    once to collect the triples of the buckets whose digests differ. Memory use therefore grows
+    with the number of changed subjects, not with the size of the ontology.
+
+    Parameters
+    ----------
+    old : str
+        Path to the old version, an ontology file or quadstore
+    new : str
+        Path to the new version, an ontology file or quadstore
+    buckets : int, optional
+        Number of subject buckets, by default 65536
+
+    Returns
+    -------
+    tuple
+        DataFrame of the added, removed and changed entities with their types and the number of
+        added and removed triples, and DataFrame of the added and removed triples, with the
+        datatype of literal objects
+    """
+    old_sums, old_counts = bucket_digests(old, buckets)
+    new_sums, new_counts = bucket_digests(new, buckets)
+    logger.info(f"Read {sum(old_counts)} triples from {old} and {sum(new_counts)} triples from {new}.")
+
+    selected = set(
+        b for b in range(buckets)
+        if old_sums[b] != new_sums[b] or old_counts[b] != new_counts[b]
+    )
+    logger.info(f"{len(selected)} of {buckets} subject buckets differ.")
+
+    old_triples = bucket_triples(old, buckets, selected) if selected else {}
+    new_triples = bucket_triples(new, buckets, selected) if selected else {}
+
+    entities = []
+    triples = []
+    for s in sorted(old_triples.keys() | new_triples.keys()):
+        old_po = old_triples.get(s, set())
+        new_po = new_triples.get(s, set())
+        added = new_po - old_po
+        removed = old_po - new_po
+        if not added and not removed:
+            continue
+
+        if s not in old_triples:
+            status = 'added'
+        elif s not in new_triples:
+            status = 'removed'
+        else:
+            status = 'changed'
+
+        # The types of the entity, owl:NamedIndividual left out as it adds nothing to the classes of an individual
+        types = sorted(set(compact(o) for p, o, d in (new_po or old_po) if p == rdf_type_iri and o != owl_named_individual_iri))
+        entities.append({'entity': compact(s), 'type': ';'.join(types), 'status': status, 'added': len(added), 'removed': len(removed)})
+
+        for change, po in [('removed', removed), ('added', added)]:
+            for p, o, d in sorted(po):
+                triples.append({'status': change, 'subject': compact(s), 'predicate': compact(p), 'object': compact(o) if not d else o, 'datatype': compact(d)})
+
+    entities = pd.DataFrame(entities, columns=['entity', 'type', 'status', 'added', 'removed'])
+    triples = pd.DataFrame(triples, columns=['status', 'subject', 'predicate', 'object', 'datatype'])
+    return entities, triples
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    entities, triples = diff_ontologies(args.old, args.new, buckets=args.buckets)
+
+    os.makedirs(args.output, exist_ok=True)
+    entities.to_csv(os.path.join(args.output, 'entities.tsv'), sep='\t', index=False)
+    triples.to_csv(os.path.join(args.output, 'triples.tsv'), sep='\t', index=False)
+
+    if len(entities) == 0:
+        logger.success("The two versions of the ontology have the same triples.")
+    else:
+        summary = entities.groupby(['type', 'status']).size().unstack(fill_value=0)
+        logger.success(f"{len(entities)} entities and {len(triples)} triples differ, written to {args.output}:\n{summary.to_string()}")
@@ -1,7 +1,29 @@
 import argparse
-from owlready2 import get_ontology, Thing, ThingClass
-import pandas as pd
+from owlready2 import Thing, ThingClass, ObjectPropertyClass, DataPropertyClass, from_literal
+import csv
 import os
+import time
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from readers import load_ontology, is_quadstore
+
+# Entity types that can be exported: (default columns, drop the entities without attributes)
+entity_tables = {
+    'PanGene': (['name', 'accession', 'has_predicted_phenotype', 'has_resistance_class', 'is_from_database', 'same_as'], True),
+    'OriginalGene': (['name', 'accession', 'has_predicted_phenotype', 'has_resistance_class', 'is_from_database', 'has_pan_name'], True),
+    'PanProtein': (['name', 'accession', 'has_length', 'member_of'], False),
+    'PanProteinCluster': (['name', 'has_members', 'folds_to'], False),
+    'PanGeneCluster': (['name', 'has_members', 'translates_to'], False),
+}
+
+# Link tables: (entity type, property linking it to the other entity, column names)
+link_tables = {
+    'gene_cluster': ('PanGene', 'member_of', ['gene', 'gene_cluster']),
+    'gene_protein': ('PanGene', 'translates_to', ['gene', 'protein']),
+    'protein_cluster': ('PanProtein', 'member_of', ['protein', 'protein_cluster']),
+}
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -10,23 +32,38 @@ def parse_args():
         '-f', '--file', 
         type=str, 
         required=True, 
-        help='Path to the ontology file',
+        help='Path to the ontology file (.owl) or the SQLite quadstore (.sqlite3) written by the build',
         dest='file'
     )
     parser.add_argument(
         '-o', '--output', 
         type=str, 
         required=True, 
-        help='Path to the output file',
+        help='Path to the output file, or the output directory when exporting several tables',
         dest='output'
     )
+    parser.add_argument(
+        '-e', '--entities',
+        type=str,
+        nargs='+',
+        default=['PanGene'],
+        choices=list(entity_tables),
+        help='Entity types to export, one table per type',
+        dest='entities'
+    )
+    parser.add_argument(
+        '-l', '--links',
+        action='store_true',
+        help=f"Also export the link tables ({', '.join(link_tables)})",
+        dest='links'
+    )
 
     parser.add_argument(
         '-c', '--columns',
         type=str,
         nargs='+',
-        default=['name', 'accession', 'has_predicted_phenotype', 'has_resistance_class', 'is_from_database', 'same_as'],
-        help='Features and classes to include in the output file',
+        default=None,
+        help='Features and classes to include in the output tables, by default the columns of each entity type in entity_tables',
         dest='columns',
         choices=[
             'name', 
@@ -38,6 +75,7 @@ def parse_args():
             'has_resistance_class', 
             'is_from_database', 
             'same_as', 
+            'has_pan_name',
             'gene_alt_name', 
             'member_of', 
             'has_members',
@@ -48,44 +86,552 @@ def parse_args():
         ]
 
     )
+    parser.add_argument(
+        '--format',
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet', 'arrow', 'feather'],
+        help='Output format. Parquet, Arrow and Feather files hold the multi-valued properties as list columns and require pyarrow',
+        dest='format'
+    )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default='sql',
+        choices=['sql', 'objects'],
+        help='Read the properties with one SQL query each from the quadstore (sql), or gene by gene through owlready2 (objects)',
+        dest='engine'
+    )
+    parser.add_argument(
+        '-t', '--threads',
+        type=int,
+        default=1,
+        help='Number of properties to query concurrently with the sql engine, only used when exporting from a quadstore (.sqlite3)',
+        dest='threads'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=10000,
+        help='Number of rows to write to the output file at a time',
+        dest='chunk_size'
+    )
 
     return parser.parse_args()
 
+# Columns holding integers in the columnar formats, the other literal columns hold strings
+integer_columns = ['has_length']
+
+def gene_values(gene, col: str) -> list:
+    """Get the values of a property of a gene, with entities given by name
+
+    Parameters
+    ----------
+    gene : Thing
+        The gene
+    col : str
+        Name of the property
+
+    Returns
+    -------
+    list
+        The values of the property, empty if it has none
+    """
+    value = getattr(gene, col)
+    if not isinstance(value, list):
+        value = [] if value is None else [value]
+    return [str(v.name) if isinstance(v, (Thing, ThingClass)) else v for v in value]
+
+def object_rows(entities, columns: list):
+    """Generate the rows of the entities, reading the properties of each entity through owlready2
+
+    Parameters
+    ----------
+    entities : iterable
+        The entities to export
+    columns : list
+        Properties to include in the rows
+
+    Yields
+    ------
+    list
+        The values of each property of an entity
+    """
+    for entity in entities:
+        yield [gene_values(entity, col) for col in columns]
+
+def iri_name(iri: str) -> str:
+    """Get the name owlready2 gives the entity with an IRI"""
+    for sep in ['#', '/', ':']:
+        if sep in iri:
+            return iri.rsplit(sep, 1)[1]
+    return iri
+
+def query_property(db, onto, col: str) -> dict:
+    """Get the values of a property for all subjects with a single query
+
+    The values of each subject are in the order owlready2 returns them in.
+
+    Parameters
+    ----------
+    db : sqlite3.Connection
+        Connection to the quadstore
+    onto : Ontology
+        The ontology object
+    col : str
+        Name of the property
+
+    Returns
+    -------
+    dict
+        Lists of (value, datatype) tuples keyed by subject storid. The datatype is None for entities,
+        whose value is their storid.
+    """
+    prop = onto[col]
+    if isinstance(prop, ObjectPropertyClass) and prop.inverse is not None:
+        # Relations in either direction, as the sorted union owlready2 returns
+        queries = ["SELECT s, o, NULL FROM objs WHERE p = ? UNION SELECT o, s, NULL FROM objs WHERE p = ? ORDER BY 1, 2"]
+        params = [(prop.storid, prop.inverse.storid)]
+    elif isinstance(prop, ObjectPropertyClass):
+        queries = ["SELECT s, o, NULL FROM objs WHERE p = ? ORDER BY s, rowid"]
+        params = [(prop.storid,)]
+    elif isinstance(prop, DataPropertyClass):
+        queries = ["SELECT s, o, d FROM datas WHERE p = ? ORDER BY s, rowid"]
+        params = [(prop.storid,)]
+    else:
+        # Annotations can refer to entities and literals
+        queries = ["SELECT s, o, NULL FROM objs WHERE p = ? ORDER BY s, rowid", "SELECT s, o, d FROM datas WHERE p = ? ORDER BY s, rowid"]
+        params = [(prop.storid,), (prop.storid,)]
+
+    values = {}
+    for query, param in zip(queries, params):
+        for s, o, d in db.execute(query, param):
+            values.setdefault(s, []).append((o, d))
+    return values
+
+def entity_names(db, storids: set) -> dict:
+    """Map entity storids to names in bulk
+
+    Parameters
+    ----------
+    db : sqlite3.Connection
+        Connection to the quadstore
+    storids : set
+        The storids of the entities
+
+    Returns
+    -------
+    dict
+        Entity names keyed by storid
+    """
+    storids = list(storids)
+    names = {}
+    for i in range(0, len(storids), 500):
+        batch = storids[i:i + 500]
+        for storid, iri in db.execute(f"SELECT storid, iri FROM resources WHERE storid IN ({','.join(['?'] * len(batch))})", batch):
+            names[storid] = iri_name(iri)
+    return names
+
+class QuadstoreReader:
+    """Set-based reads of entity properties from the quadstore
+
+    Every property is read with one query over all subjects, and the values are joined on the
+    storid of the entities. The query results and entity names are shared between all tables
+    read with the same reader, so each property and name is only looked up once. With a
+    quadstore file, the properties can be queried concurrently, each thread on a read-only
+    connection of its own.
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    source : str
+        Path to the ontology file or quadstore the ontology was loaded from
+    threads : int, optional
+        Number of properties to query concurrently, by default 1
+    """
+
+    def __init__(self, onto, source: str, threads: int = 1):
+        self.onto = onto
+        self.source = source
+        self.threads = threads
+        self.db = onto.world.graph.db
+        self.values = {}
+        self.names = {}
+
+    def instances(self, cls: ThingClass) -> list:
+        """Get the storids of the instances of a class, in the order of cls.instances()"""
+        query = self.onto.world.prepare_sparql("SELECT DISTINCT ?i { ?i a/(rdfs:subClassOf|owl:equivalentClass|^owl:equivalentClass)* ?? . }")
+        return [s for (s,) in query.execute_raw((cls,))]
+
+    def query(self, properties: list):
+        """Query the values of the properties that were not queried yet
+
+        Parameters
+        ----------
+        properties : list
+            Names of the properties
+        """
+        properties = [col for col in dict.fromkeys(properties) if col not in self.values]
+
+        # Query concurrently on connections of their own if the quadstore is a file
+        if self.threads > 1 and len(properties) > 1 and is_quadstore(self.source):
+            def query(col):
+                connection = sqlite3.connect(f"file:{os.path.abspath(self.source)}?mode=ro", uri=True, check_same_thread=False)
+                try:
+                    return query_property(connection, self.onto, col)
+                finally:
+                    connection.close()
+
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                self.values.update(zip(properties, executor.map(query, properties)))
+        else:
+            self.values.update({col: query_property(self.db, self.onto, col) for col in properties})
+
+    def resolve(self, storids: set):
+        """Look up the names of the entities that were not looked up yet"""
+        self.names.update(entity_names(self.db, set(storids) - self.names.keys()))
+
+    def rows(self, cls: ThingClass, columns: list):
+        """Generate the rows of the instances of a class, the same as object_rows
+
+        Parameters
+        ----------
+        cls : ThingClass
+            The class of the entities to export
+        columns : list
+            Properties to include in the rows
+
+        Yields
+        ------
+        list
+            The values of each property of an entity
+        """
+        subjects = self.instances(cls)
+        properties = [col for col in columns if col != 'name']
+        self.query(properties)
+
+        # Look up the names of the entities and of all entities they refer to
+        storids = set(subjects)
+        for col in properties:
+            for s in subjects:
+                storids.update(o for o, d in self.values[col].get(s, []) if d is None)
+        self.resolve(storids)
+
+        for s in subjects:
+            row = []
+            for col in columns:
+                if col == 'name':
+                    row.append([self.names[s]])
+                else:
+                    row.append([self.names[o] if d is None else from_literal(o, d, self.onto.world) for o, d in self.values[col].get(s, [])])
+            yield row
+
+def link_rows(rows):
+    """Turn rows of entity names and the names of one property's values into one row per relation
+
+    Parameters
+    ----------
+    rows : iterable
+        Rows of the form [[name], [value, ...]]
+
+    Yields
+    ------
+    list
+        Rows of the form [[name], [value]]
+    """
+    for name, values in rows:
+        for value in values:
+            yield [name, [value]]
+
+def drop_empty_rows(rows, columns: list):
+    """Drop the rows that have no value in any attribute column
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows
+    columns : list
+        Column names
+
+    Yields
+    ------
+    list
+        The rows with at least one attribute
+    """
+    attributes = [i for i, col in enumerate(columns) if col not in ['name']]
+    for row in rows:
+        if any(v != '' for i in attributes for v in row[i]):
+            yield row
+
+def iter_chunks(rows, chunk_size: int, total: int = None):
+    """Group rows into chunks, logging the progress and throughput after each chunk
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows
+    chunk_size : int
+        Number of rows per chunk
+    total : int, optional
+        Number of entities to export, before dropping empty rows, to report the progress against, by default None
+
+    Yields
+    ------
+    list
+        A chunk of rows
+    """
+    n_rows = 0
+    start = time.perf_counter()
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            n_rows += len(chunk)
+            chunk = []
+
+            elapsed = time.perf_counter() - start
+            logger.info(f"Exported {n_rows}{f'/{total}' if total else ''} rows ({n_rows / elapsed:.0f} rows/s).")
+
+    if len(chunk) > 0:
+        yield chunk
+
+def write_csv(rows, columns: list, output: str, chunk_size: int = 10000, total: int = None) -> int:
+    """Stream rows to a CSV file in chunks, joining multiple values with ';'
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to write
+    columns : list
+        Column names of the header
+    output : str
+        Path to the output file
+    chunk_size : int, optional
+        Number of rows to write at a time, by default 10000
+    total : int, optional
+        Number of entities to export, before dropping empty rows, to report the progress against, by default None
+
+    Returns
+    -------
+    int
+        Number of written rows
+    """
+    n_rows = 0
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns)
+
+        for chunk in iter_chunks(rows, chunk_size, total):
+            writer.writerows([[';'.join([str(v) for v in values]) for values in row] for row in chunk])
+            n_rows += len(chunk)
+
+    return n_rows
+
+def ontology_metadata(onto, file: str) -> dict:
+    """Describe the version of the exported ontology, to store in the metadata of columnar files
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    file : str
+        Path to the ontology file the export was made from
+
+    Returns
+    -------
+    dict
+        The ontology IRI, its owl:versionInfo, and the name and SHA-256 checksum of the ontology file
+    """
+    sha256 = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+
+    return {
+        'panres.ontology_iri': onto.base_iri,
+        'panres.ontology_version': ';'.join([str(v) for v in onto.metadata.versionInfo]),
+        'panres.source': os.path.basename(file),
+        'panres.source_sha256': sha256.hexdigest(),
+    }
+
+def entity_dictionaries(onto, columns: list) -> dict:
+    """Get the names of all entities each object property column can refer to
+
+    Every record batch of a column is encoded with the same dictionary, as Arrow IPC files do
+    not allow the dictionary of a column to change between batches.
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    columns : list
+        Properties to include in the output
+
+    Returns
+    -------
+    dict
+        Sorted entity names keyed by column, for the object property columns
+    """
+    dictionaries = {}
+    for col in columns:
+        prop = onto[col]
+        if not isinstance(prop, ObjectPropertyClass):
+            continue
+
+        # The values of a property include the subjects of its inverse property
+        objects = onto.world.graph.db.execute(
+            "SELECT o FROM objs WHERE p = ? AND o > 0 UNION SELECT s FROM objs WHERE p = ? AND s > 0",
+            (prop.storid, prop.inverse.storid if prop.inverse is not None else 0)
+        )
+        entities = [onto.world._get_by_storid(o) for (o,) in objects]
+        dictionaries[col] = sorted(set(str(e.name) for e in entities if isinstance(e, (Thing, ThingClass))))
+    return dictionaries
+
+def write_columnar(rows, columns: list, output: str, fmt: str, onto, metadata: dict, scalars: list = ['name'], chunk_size: int = 10000, total: int = None) -> int:
+    """Stream rows to a Parquet, Arrow or Feather file in record batches
+
+    The entity names are a string column, and every property is a list column. The names of the
+    entities in the object property columns are dictionary-encoded, so they are read as
+    categoricals. The schema metadata records the version of the ontology.
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to write
+    columns : list
+        Column names
+    output : str
+        Path to the output file
+    fmt : str
+        Output format, 'parquet', 'arrow' (uncompressed Arrow IPC file) or 'feather' (LZ4 compressed Arrow IPC file)
+    onto : Ontology
+        The ontology object
+    metadata : dict
+        Schema metadata, see ontology_metadata
+    scalars : list, optional
+        Columns holding a single string instead of a list, by default ['name']
+    chunk_size : int, optional
+        Number of rows per record batch, by default 10000
+    total : int, optional
+        Number of entities to export, before dropping empty rows, to report the progress against, by default None
+
+    Returns
+    -------
+    int
+        Number of written rows
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(f"Exporting to {fmt} requires pyarrow, install it with 'pip install pyarrow'.") from e
+
+    dictionaries = entity_dictionaries(onto, columns)
+    dictionary_arrays = {col: pa.array(names, type=pa.string()) for col, names in dictionaries.items()}
+    dictionary_indices = {col: {name: i for i, name in enumerate(names)} for col, names in dictionaries.items()}
+
+    # Arrow types of the columns
+    fields = []
+    for col in columns:
+        if col in scalars:
+            fields.append(pa.field(col, pa.string()))
+        elif col in dictionaries:
+            fields.append(pa.field(col, pa.list_(pa.dictionary(pa.int32(), pa.string()))))
+        elif col in integer_columns:
+            fields.append(pa.field(col, pa.list_(pa.int64())))
+        else:
+            fields.append(pa.field(col, pa.list_(pa.string())))
+    schema = pa.schema(fields, metadata=metadata)
+
+    def record_batch(chunk):
+        arrays = []
+        for i, col in enumerate(columns):
+            if col in scalars:
+                arrays.append(pa.array([str(row[i][0]) if row[i] else None for row in chunk], type=pa.string()))
+                continue
+
+            offsets = [0]
+            flat = []
+            for row in chunk:
+                flat.extend(row[i])
+                offsets.append(len(flat))
+
+            if col in dictionaries:
+                values = pa.DictionaryArray.from_arrays(pa.array([dictionary_indices[col][v] for v in flat], type=pa.int32()), dictionary_arrays[col])
+            elif col in integer_columns:
+                values = pa.array([int(v) for v in flat], type=pa.int64())
+            else:
+                values = pa.array([str(v) for v in flat], type=pa.string())
+            arrays.append(pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), values))
+        return pa.record_batch(arrays, schema=schema)
+
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(output, schema)
+    else:
+        options = pa.ipc.IpcWriteOptions(compression='lz4' if fmt == 'feather' else None)
+        writer = pa.ipc.new_file(output, schema, options=options)
+
+    n_rows = 0
+    with writer:
+        for chunk in iter_chunks(rows, chunk_size, total):
+            writer.write_batch(record_batch(chunk))
+            n_rows += len(chunk)
+
+    return n_rows
+
+def write_table(rows, columns: list, output: str, fmt: str, onto, metadata: dict, scalars: list = ['name'], chunk_size: int = 10000, total: int = None) -> int:
+    """Write a table in the requested format, see write_csv and write_columnar"""
+    if fmt == 'csv':
+        return write_csv(rows, columns, output, chunk_size=chunk_size, total=total)
+    return write_columnar(rows, columns, output, fmt, onto, metadata, scalars=scalars, chunk_size=chunk_size, total=total)
+
 if __name__ == "__main__":
     args = parse_args()
     
-    # Load the ontology
-    onto = get_ontology(args.file).load()  
-
-    # Get the data specified by the user
-    data = []
-    for gene in onto.PanGene.instances():
-        row = {}
-        for col in args.columns:
-            value = getattr(gene, col)
-            if isinstance(value, list):
-                vv = []
-                for v in value:
-                    if isinstance(v, ThingClass) or isinstance(v, Thing):
-                        vv.append(str(v.name))
-                    else:
-                        vv.append(str(v))
-                value = ';'.join(vv)
-            elif isinstance(value, Thing):
-                value = str(value.name)
-            row[col] = value
-        data.append(row)
-    
-    # Convert data to pandas dataframe
-    df = pd.DataFrame(data)
+    # Load the ontology once for all tables, opening a quadstore read-only instead of parsing the OWL file
+    onto = load_ontology(args.file)
+    metadata = ontology_metadata(onto, args.file) if args.format != 'csv' else None
 
-    # Replace empty strings with NaN
-    df = df.replace('', pd.NA)
-    
-    # Drop empty rows in attribute columns
-    columns = [col for col in args.columns if col not in ['name']]
-    df = df.dropna(subset=columns, how='all')
+    # A single table is written to the output file, several tables to the output directory
+    if len(args.entities) == 1 and not args.links:
+        outputs = {args.entities[0]: args.output}
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    else:
+        tables = args.entities + (list(link_tables) if args.links else [])
+        outputs = {table: os.path.join(args.output, f"{table}.{args.format}") for table in tables}
+        os.makedirs(args.output, exist_ok=True)
+
+    # The sql engine shares the queried properties and entity names between the tables
+    reader = QuadstoreReader(onto, args.file, threads=args.threads) if args.engine == 'sql' else None
+    def entity_rows(entity, columns):
+        if reader is not None:
+            return reader.rows(getattr(onto, entity), columns)
+        return object_rows(getattr(onto, entity).instances(), columns)
+
+    def entity_count(entity):
+        if reader is not None:
+            return len(reader.instances(getattr(onto, entity)))
+        return len(getattr(onto, entity).instances())
+
+    # Stream the data specified by the user to the output files
+    for entity in args.entities:
+        default_columns, drop_empty = entity_tables[entity]
+        columns = args.columns or default_columns
+
+        start = time.perf_counter()
+        rows = entity_rows(entity, columns)
+        if drop_empty:
+            rows = drop_empty_rows(rows, columns)
+        n_rows = write_table(rows, columns, outputs[entity], args.format, onto, metadata, chunk_size=args.chunk_size, total=entity_count(entity))
+        logger.success(f"Exported {n_rows} {entity} entities to {outputs[entity]} in {time.perf_counter() - start:.1f}s.")
 
-    # Save the dataframe to a CSV file
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    df.to_csv(args.output, index=False)
\ No newline at end of file
+    if args.links:
+        for table, (entity, prop, columns) in link_tables.items():
+            start = time.perf_counter()
+            rows = link_rows(entity_rows(entity, ['name', prop]))
+            n_rows = write_table(rows, columns, outputs[table], args.format, onto, metadata, scalars=columns, chunk_size=args.chunk_size)
+            logger.success(f"Exported {n_rows} {table} links to {outputs[table]} in {time.perf_counter() - start:.1f}s.")
@@ -1,8 +1,66 @@
-import subprocess
 from owlready2 import *
 import pandas as pd
 from graphviz import Digraph
 from IPython.display import Image, display
+from readers import load_ontology
+from pubmed import PubMedLookup
+
+# In-memory index of the entities in each ontology, keyed by ontology and then by their full IRI
+entity_index = {}
+entity_index_stats = {'hits': 0, 'misses': 0}
+
+# Index of the pan genes from each database, keyed by ontology and then by the IRI of the database instance
+database_index = {}
+
+# Inverted index of the pan genes linked to each target, keyed by ontology, property name and then target
+property_index = {}
+
+# Transitive closure of the target hierarchy of each ontology, with the ancestors and descendants of each class as integer bitsets
+hierarchy_index = {}
+
+def lookup_entity(onto: Ontology, iri: str) -> Thing:
+    """Look up an entity by its full IRI, using the entity index before searching the ontology
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    iri : str
+        The full IRI of the entity
+
+    Returns
+    -------
+    Thing
+        The entity if found, otherwise None
+    """
+    index = entity_index.setdefault(onto, {})
+    entity = index.get(iri)
+    if entity is not None:
+        entity_index_stats['hits'] += 1
+        return entity
+
+    # Fall back to the ontology for entities not created through the helper functions
+    entity_index_stats['misses'] += 1
+    entity = onto.search_one(iri = iri)
+    if entity is not None:
+        index[iri] = entity
+    return entity
+
+def forget_entity(entity: Thing) -> None:
+    """Remove an entity from the entity index of every ontology, e.g. before destroying it
+
+    Parameters
+    ----------
+    entity : Thing
+        The entity to remove from the index
+    """
+    for index in entity_index.values():
+        index.pop(entity.iri, None)
+
+def clear_entity_index() -> None:
+    """Empty the entity index of all ontologies and reset its counters, e.g. when the quadstore is replaced"""
+    entity_index.clear()
+    entity_index_stats.update(hits = 0, misses = 0)
 
 def get_instance(onto: Ontology, name: str) -> Thing:
     """Retrieves an instance from the ontology based on its name
@@ -27,7 +85,7 @@ def get_instance(onto: Ontology, name: str) -> Thing:
     full_iri = onto.base_iri + cleaned_name
 
     # Search for the instance
-    instance = onto.search_one(iri = full_iri)
+    instance = lookup_entity(onto, full_iri)
     return instance
 
 
@@ -53,10 +111,11 @@ def get_or_create_instance(onto: Ontology, cls: Thing, name: str) -> Thing:
     full_iri = onto.base_iri + name
     
     # Search for the instance
-    instance = onto.search_one(iri=full_iri)#"*{}".format(name))
+    instance = lookup_entity(onto, full_iri)
     if instance is None:
         # Create the instance if it doesn't exist
         instance = cls(name)
+        entity_index.setdefault(onto, {})[full_iri] = instance
 
     return instance
 
@@ -82,11 +141,12 @@ def get_or_create_subclass(onto: Ontology, parent_cls: Thing, subclass_name: str
     cleaned_name = subclass_name.replace(" ", "_").replace("-", "_")
 
     # Search for the subclass in the ontology
-    subclass_instance = onto.search_one(iri = onto.base_iri + cleaned_name)
+    subclass_instance = lookup_entity(onto, onto.base_iri + cleaned_name)
     
     # Create if it doesnt exist
     if subclass_instance is None:
         subclass_instance = types.new_class(cleaned_name, (parent_cls, ))
+        entity_index.setdefault(onto, {})[subclass_instance.iri] = subclass_instance
 
         # Set the label to the original name with spaces
         subclass_instance.label = [cleaned_name]
@@ -98,6 +158,9 @@ def find_original_name(gene_instance: Thing, database_name: str) -> Thing:
     """
     Finds the original name of a gene instance from a specific database.
 
+    When the gene has several original names from the database, the one with the lowest name
+    is returned, so the result does not depend on the order of gene_instance.same_as.
+
     Parameters
     ----------
     gene_instance : Thing
@@ -111,15 +174,180 @@ def find_original_name(gene_instance: Thing, database_name: str) -> Thing:
         The original gene instance if found, otherwise None.
     """
     # Check if the gene has an original name
-    for og in gene_instance.same_as:
-        for ogname in og.is_from_database:
-            if ogname.name == database_name:
-                return og
+    ogs = [og for og in gene_instance.same_as if any(ogname.name == database_name for ogname in og.is_from_database)]
+    return min(ogs, key=lambda og: og.name, default=None)
+
+def register_gene_database(gene: Thing, og: Thing, database_instance: Thing) -> None:
+    """Add a pan gene and its original gene to the database index
+
+    Of the original genes registered for a pan gene and a database, the one with the lowest
+    name is kept, matching the result of find_original_name.
+
+    Parameters
+    ----------
+    gene : Thing
+        The pan gene instance
+    og : Thing
+        The original gene instance from the database
+    database_instance : Thing
+        The database instance
+    """
+    index = database_index.setdefault(database_instance.namespace.ontology, {})
+    genes = index.setdefault(database_instance.iri, {})
+    current = genes.get(gene)
+    if current is None or og.name < current.name:
+        genes[gene] = og
+
+def index_genes_by_database(onto: Ontology) -> dict:
+    """Build the database index of the ontology in a single pass over the pan genes
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+
+    Returns
+    -------
+    dict
+        The pan genes and their original genes, keyed by the IRI of the database instance
+    """
+    index = database_index[onto] = {}
+    for gene in onto.PanGene.instances():
+        if onto.PanGene not in gene.is_a:
+            continue
+        for database_instance in gene.is_from_database:
+            index.setdefault(database_instance.iri, {})[gene] = find_original_name(gene, database_instance.name)
+    return index
+
+def clear_database_index() -> None:
+    """Empty the database index of all ontologies, e.g. when the quadstore is replaced"""
+    database_index.clear()
+
+def index_genes_by_property(onto: Ontology, property_name: str) -> dict:
+    """Get the pan genes linked to each target by a property, building the index in a single pass over the pan genes
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    property_name : str
+        Name of the property linking the pan genes to their targets, e.g. 'has_resistance_class'
+
+    Returns
+    -------
+    dict
+        Lists of pan genes, in the order of onto.PanGene.instances(), keyed by target
+    """
+    indices = property_index.setdefault(onto, {})
+    index = indices.get(property_name)
+    if index is None:
+        index = {}
+        for gene in onto.PanGene.instances():
+            for target in set(getattr(gene, property_name)):
+                index.setdefault(target, []).append(gene)
+        indices[property_name] = index
+    return index
+
+def clear_property_index() -> None:
+    """Empty the inverted property index of all ontologies, e.g. when the quadstore is replaced or after adding targets"""
+    property_index.clear()
+
+def index_hierarchy(onto: Ontology) -> dict:
+    """Get the transitive closure of the target hierarchy, building it on the first call
+
+    All subclasses of ResistanceType (resistance classes, phenotypes, biocides, metals, 
+    unclassified resistances and mechanisms) are numbered, and the ancestors and descendants
+    of each class are stored as integer bitsets, with bit i set for class number i. A class
+    is included in its own ancestors and descendants.
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+
+    Returns
+    -------
+    dict
+        The classes ('classes'), their numbers keyed by class ('ids') and by name ('names'), 
+        and the bitsets of their ancestors ('ancestors') and descendants ('descendants')
+    """
+    if onto in hierarchy_index:
+        return hierarchy_index[onto]
+
+    classes = list(onto.ResistanceType.descendants(include_self = False))
+    ids = {cls: i for i, cls in enumerate(classes)}
+    parents = [[ids[p] for p in cls.is_a if p in ids] for cls in classes]
+
+    # Collect the ancestors of each class depth-first, memoising the bitsets of the parents
+    ancestors = [None] * len(classes)
+    def collect_ancestors(i: int, visiting: int = 0) -> int:
+        if ancestors[i] is None:
+            bits = 1 << i
+            for p in parents[i]:
+                if not (visiting >> p) & 1:
+                    bits |= collect_ancestors(p, visiting | (1 << i))
+            ancestors[i] = bits
+        return ancestors[i]
+    
+    descendants = [1 << i for i in range(len(classes))]
+    for i in range(len(classes)):
+        for a in iter_bits(collect_ancestors(i)):
+            descendants[a] |= 1 << i
+
+    hierarchy_index[onto] = dict(
+        classes = classes,
+        ids = ids,
+        names = {cls.name: i for i, cls in enumerate(classes)},
+        ancestors = ancestors,
+        descendants = descendants
+    )
+    return hierarchy_index[onto]
+
+def iter_bits(bits: int):
+    """Iterate over the positions of the set bits of an integer bitset, from low to high"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def get_descendants(onto: Ontology, class_instance: Thing, include_self: bool = True) -> list:
+    """Get all classes below a class in the target hierarchy, following every parent of classes with multiple parents
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    class_instance : Thing
+        The class to get the descendants of
+    include_self : bool, optional
+        Include the class itself, by default True
+
+    Returns
+    -------
+    list
+        The descendant classes
+    """
+    hierarchy = index_hierarchy(onto)
+    i = hierarchy['ids'].get(class_instance)
+    if i is None:
+        return [class_instance] if include_self else []
+
+    bits = hierarchy['descendants'][i]
+    if not include_self:
+        bits &= ~(1 << i)
+    return [hierarchy['classes'][j] for j in iter_bits(bits)]
+
+def clear_hierarchy_index() -> None:
+    """Empty the hierarchy index of all ontologies, e.g. when the quadstore is replaced or after adding or removing targets"""
+    hierarchy_index.clear()
 
 def find_genes_from_database(onto: Ontology, database_name: str) -> dict:    
     """
     Finds genes from a specific database in the ontology
 
+    The genes are read from the database index, which is filled while the PanRes genes
+    are added to the ontology, or built in one pass on the first call for a loaded ontology.
+
     Parameters
     ----------
     onto : Ontology
@@ -134,17 +362,19 @@ def find_genes_from_database(onto: Ontology, database_name: str) -> dict:
     """
 
     # Search for the database instance
-    database_instance = onto.search_one(iri="*{}".format(database_name))
+    database_instance = get_instance(onto, database_name)
     
     if not database_instance:
         print(f"Database '{database_name}' not found in the ontology.")
         return []
     
-    # Find all genes associated with the database
-    genes = [gene for gene in onto.PanGene.instances() if database_instance in gene.is_from_database and onto.PanGene in gene.is_a]
+    # Build the index if the genes of this ontology were not added in this session
+    index = database_index.get(onto)
+    if index is None:
+        index = index_genes_by_database(onto)
 
     # Map genes to their original gene instances
-    gene2og = {gene: find_original_name(gene, database_name) for gene in genes}
+    gene2og = dict(index.get(database_instance.iri, {}))
     return gene2og
 
 def get_genes_from_database(onto: Ontology, database_name: str):
@@ -206,7 +436,33 @@ def clean_gene_name(gene_name: str, db: str) -> str:
     else:
         return gene_name    
 
-def accession_to_pubmed(accession: str) -> list:
+def accessions_to_pubmed(accessions: list, cache_file: str = 'pubmed_cache.sqlite3', fixture: str = None, **kwargs) -> dict:
+    """
+    Retrieves PubMed IDs associated with many protein or gene accessions, in batches and through a persistent cache
+
+    Parameters
+    ----------
+    accessions : list
+        The protein accessions
+    cache_file : str, optional
+        Path to the SQLite cache of the lookups, by default 'pubmed_cache.sqlite3'
+    fixture : str, optional
+        Path to a JSON file mapping accessions to PubMed IDs, to run offline, by default None
+    **kwargs
+        Further options of pubmed.PubMedLookup, e.g. api_key or workers
+
+    Returns
+    -------
+    dict
+        Lists of PubMed IDs keyed by accession, leaving out the accessions whose lookup failed
+    """
+    pubmed_lookup = PubMedLookup(cache_file = cache_file, fixture = fixture, **kwargs)
+    try:
+        return pubmed_lookup.lookup(accessions)
+    finally:
+        pubmed_lookup.close()
+
+def accession_to_pubmed(accession: str, **kwargs) -> list:
     """
     Retrieves PubMed IDs associated with a protein or gene accession
 
@@ -214,26 +470,38 @@ def accession_to_pubmed(accession: str) -> list:
     ----------
     accession : str
         The protein accession
+    **kwargs
+        Options of accessions_to_pubmed
 
     Returns
     -------
     list
         A list of PubMed IDs
     """
+    return accessions_to_pubmed([accession], **kwargs).get(accession)
 
-    # Construct the command to retrieve PubMed IDs
-    cmd = f"esearch -db protein -query {accession} | elink -target pubmed | efetch -format uid"
+def find_class(onto: Ontology, class_name: str) -> Thing:
+    """Find a class by name, preferring an exact match in the target hierarchy over a search on the end of the IRI
 
-    # Run the command
-    p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-    # Check if the command was successful
-    if p.returncode == 0:
-        return p.stdout.decode().strip().split()
-    
-    return None
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    class_name : str
+        Name of the class
 
-def get_subclasses(onto: Thing, class_name: str) -> pd.DataFrame: 
+    Returns
+    -------
+    Thing
+        The class if found, otherwise None
+    """
+    hierarchy = index_hierarchy(onto)
+    i = hierarchy['names'].get(class_name)
+    if i is not None:
+        return hierarchy['classes'][i]
+    return onto.search_one(iri=f"*{class_name}")
+
+def get_subclasses(onto: Thing, class_name: str, transitive: bool = False) -> pd.DataFrame: 
     """Find subclasses of an Ontology class
 
     Parameters
@@ -242,14 +510,19 @@ def get_subclasses(onto: Thing, class_name: str) -> pd.DataFrame:
         The loaded ontology to query
     class_name : str
         Subclasses of class_name to find
+    transitive : bool, optional
+        Include all descendants in the target hierarchy instead of only the direct subclasses, by default False
 
     Returns
     -------
     pd.DataFrame
         Column containing subclass matches of the class_name
     """
-    class_match = onto.search_one(iri=f"*{class_name}")
-    subclasses = [sc.name for sc in list(class_match.subclasses())]
+    class_match = find_class(onto, class_name)
+    if transitive:
+        subclasses = [sc.name for sc in get_descendants(onto, class_match, include_self = False)]
+    else:
+        subclasses = [sc.name for sc in list(class_match.subclasses())]
     
     return pd.DataFrame([class_match.name] + subclasses, columns=['match'])
 
@@ -271,14 +544,9 @@ def class_to_genes(onto: Thing, class_instance: Thing, annotation_property: Thin
         list of pan genes matched
     """
     
-    pan_instances = pd.DataFrame(onto.PanGene.instances(), columns=['instance'])
-    pan_instances['has_resistance_to_class'] = pan_instances['instance'].apply(
-        lambda x: class_instance in annotation_property[x]
-    )
-    pan_instances = pan_instances.loc[
-        pan_instances.has_resistance_to_class == True,
-    ].drop(columns='has_resistance_to_class').values.tolist()  
-    return pan_instances
+    # Look up the genes in the inverted index of the property
+    genes = index_genes_by_property(onto = onto, property_name = annotation_property.name)
+    return [[gene] for gene in genes.get(class_instance, [])]
 
 def summarise_classes(onto: Ontology, class_name: str) -> pd.DataFrame:
     """Summarise children of an ontology class and the genes associated with the class.
@@ -297,34 +565,20 @@ def summarise_classes(onto: Ontology, class_name: str) -> pd.DataFrame:
         class types of the match and the children, 
         and the number of genes.
     """
-    subclasses = get_subclasses(onto, class_name)
-    subclasses['instance'] = [onto.search_one(iri=f"*{c}") for c in subclasses.iloc[:, 0]]
+    class_match = find_class(onto, class_name)
+    instances = [class_match] + list(class_match.subclasses())
+    subclasses = pd.DataFrame({'match': [c.name for c in instances], 'instance': instances})
     subclasses['type'] = subclasses['instance'].apply(lambda x: x.is_a[0].name)
-    subclasses['n_genes'] = 0
-    
-    if any(subclasses['type'].str.endswith('Class')):
-        annotation_property = onto.has_resistance_class
-        
-        subclasses.loc[
-            subclasses['type'].str.endswith('Class'), 'n_genes'
-        ] = subclasses.loc[
-            subclasses['type'].str.endswith('Class'), 'instance'
-        ].apply(
-            lambda x: class_to_genes(onto = onto, class_instance = x, annotation_property = annotation_property)
-        ).apply(len)
-        
-        
-    if any(subclasses['type'].str.endswith('Phenotype')):
-        annotation_property = onto.has_predicted_phenotype
-    
-        subclasses.loc[
-            subclasses['type'].str.endswith('Phenotype'), 'n_genes'
-        ] = subclasses.loc[
-            subclasses['type'].str.endswith('Phenotype'), 'instance'
-        ].apply(
-            lambda x: class_to_genes(onto = onto, class_instance = x, annotation_property = annotation_property)
-        ).apply(len)
-        
+
+    # Count the genes of all classes and phenotypes from the inverted property indices
+    class_genes = index_genes_by_property(onto = onto, property_name = 'has_resistance_class')
+    phenotype_genes = index_genes_by_property(onto = onto, property_name = 'has_predicted_phenotype')
+    subclasses['n_genes'] = [
+        len(class_genes.get(instance, [])) if t.endswith('Class') 
+        else len(phenotype_genes.get(instance, [])) if t.endswith('Phenotype') 
+        else 0
+        for instance, t in zip(subclasses['instance'], subclasses['type'])
+    ]
     
     return subclasses.drop(columns=['instance']).rename(columns = {'match': 'Class'})
 
@@ -372,7 +626,7 @@ def visualize_specific_classes(onto: Ontology, class_names: list, output_file: s
     
     display(Image(filename=output_file + '.png'))
 
-def get_genes_for_class(onto: Ontology, class_name: str) -> pd.DataFrame:
+def get_genes_for_class(onto: Ontology, class_name: str, transitive: bool = False) -> pd.DataFrame:
     """Find  genes conferring resistance to a class or a phenotype
 
     Parameters
@@ -381,6 +635,8 @@ def get_genes_for_class(onto: Ontology, class_name: str) -> pd.DataFrame:
         The ontology object
     class_name : str
         Name of class to search
+    transitive : bool, optional
+        Also find the genes conferring resistance to any class or phenotype below the class, by default False
 
     Returns
     -------
@@ -388,13 +644,20 @@ def get_genes_for_class(onto: Ontology, class_name: str) -> pd.DataFrame:
         DataFrame with pan gene names, classes and phenotypes
     """
     
-    # Get database instance
-    class_instance = onto.search(iri=f"*{class_name}")[0]
+    # Get class instance, and the classes below it
+    class_instance = find_class(onto, class_name)
+    targets = get_descendants(onto, class_instance) if transitive else [class_instance]
     
-    # Get genes
+    # Get genes as the union of the genes of the targets
+    matched = set()
+    for property_name in ['has_resistance_class', 'has_predicted_phenotype']:
+        genes_by_target = index_genes_by_property(onto = onto, property_name = property_name)
+        for target in targets:
+            matched.update(genes_by_target.get(target, []))
+
     genes = [
         [gene.name, gene.has_resistance_class, gene.has_predicted_phenotype] 
-        for gene in onto.PanGene.instances() if class_instance in gene.has_resistance_class + gene.has_predicted_phenotype
+        for gene in onto.PanGene.instances() if gene in matched
     ]
     
     df = pd.DataFrame(genes, columns = ['pan_gene', 'resistance_class', 'resistance_phenotype'])
@@ -0,0 +1,204 @@
+from owlready2 import Ontology, Thing, ThingClass, OwlReadyInconsistentOntologyError, rdf_type, rdfs_subclassof
+from functions import clear_property_index, clear_hierarchy_index
+
+# Ontology receiving the inferred triples, the same one sync_reasoner writes its inferences to
+inferences_iri = "http://inferrences/"
+
+def materialize_inferences(onto: Ontology, logger) -> dict:
+    """Materialize the inferences the PanRes ontology relies on, without running an external reasoner
+
+    This computes the following closures in bulk on the quadstore:
+
+    - the inverse of same_as/has_pan_name in both directions
+    - the resistance classes of the predicted phenotypes, i.e. an individual with a phenotype
+      gets the resistance classes the phenotype (or any of its superclasses) is a subclass of
+    - the AllDisjoint axioms, checked against the types of all individuals
+
+    The inferred triples are added to the inferences ontology, like sync_reasoner does. HermiT
+    can still be run on the ontology to validate the result. As the triples are inserted
+    directly in the quadstore, the property values cached on the loaded entities and the
+    property and hierarchy indices are invalidated afterwards.
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    logger : loguru.logger
+        Logger object for logging messages
+
+    Returns
+    -------
+    dict
+        Number of inferred relations per property
+
+    Raises
+    ------
+    OwlReadyInconsistentOntologyError
+        If an individual is an instance of two disjoint classes
+    """
+    db = onto.world.graph.db
+    inferences = onto.world.get_ontology(inferences_iri)
+
+    inferred = {}
+    inferred['has_pan_name'] = infer_inverse(db, inferences.graph.c, onto.same_as, onto.has_pan_name)
+    inferred['same_as'] = infer_inverse(db, inferences.graph.c, onto.has_pan_name, onto.same_as)
+    inferred['has_resistance_class'] = infer_phenotype_classes(onto, db, inferences.graph.c)
+    onto.world.save()
+
+    # The inserts bypass owlready2, drop what was read before them
+    invalidate_property_values(onto, [onto.same_as, onto.has_pan_name, onto.has_resistance_class])
+    clear_property_index()
+    clear_hierarchy_index()
+
+    for prop, n in inferred.items():
+        logger.info(f"Inferred {n} {prop} relations.")
+
+    # Check the disjoint classes
+    violations = find_disjoint_violations(onto, db)
+    if len(violations) > 0:
+        violations_str = '\n'.join([f"{individual}: {a} and {b}" for individual, a, b in violations])
+        logger.error(f"Individuals belonging to disjoint classes:\n{violations_str}")
+        raise OwlReadyInconsistentOntologyError(f"{len(violations)} individuals belong to disjoint classes.")
+
+    logger.success("Materialized the inferences of the ontology.")
+    return inferred
+
+def invalidate_property_values(onto: Ontology, props: list) -> None:
+    """Drop the values of the properties cached on the loaded individuals, so they are read again from the quadstore
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    props : list
+        The properties whose values changed
+    """
+    names = [prop.python_name for prop in props] + [f"INVERSE_{prop.python_name}" for prop in props]
+    for entity in list(onto.world._entities.values()):
+        if isinstance(entity, Thing):
+            for name in names:
+                entity.__dict__.pop(name, None)
+
+def infer_inverse(db, c: int, prop: ThingClass, inverse: ThingClass) -> int:
+    """Add the inverse of all relations of a property that are not asserted yet
+
+    Parameters
+    ----------
+    db : sqlite3.Connection
+        Connection to the quadstore
+    c : int
+        Quadstore context of the ontology to add the inferred triples to
+    prop : ThingClass
+        The property to invert
+    inverse : ThingClass
+        Its inverse property
+
+    Returns
+    -------
+    int
+        Number of inferred relations
+    """
+    changes = db.total_changes
+    db.execute(
+        """INSERT INTO objs (c, s, p, o)
+        SELECT DISTINCT ?, r.o, ?, r.s FROM objs r
+        WHERE r.p = ? AND r.o > 0 AND NOT EXISTS (
+            SELECT 1 FROM objs x WHERE x.s = r.o AND x.p = ? AND x.o = r.s
+        )""",
+        (c, inverse.storid, prop.storid, inverse.storid)
+    )
+    return db.total_changes - changes
+
+def infer_phenotype_classes(onto: Ontology, db, c: int) -> int:
+    """Add the resistance classes of the predicted phenotypes to the individuals having the phenotypes
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    db : sqlite3.Connection
+        Connection to the quadstore
+    c : int
+        Quadstore context of the ontology to add the inferred triples to
+
+    Returns
+    -------
+    int
+        Number of inferred relations
+    """
+    class_roots = [onto.AntibioticResistanceClass, onto.BiocideClass, onto.MetalClass, onto.UnclassifiedResistanceClass]
+    phenotype_roots = [onto.AntibioticResistancePhenotype, onto.Biocide, onto.Metal, onto.UnclassifiedResistance]
+
+    class_params = ','.join(['?'] * len(class_roots))
+    phenotype_params = ','.join(['?'] * len(phenotype_roots))
+
+    # Resistance classes are the direct subclasses of the class roots (the phenotype roots excluded),
+    # ancestors holds each predicted phenotype together with all its superclasses
+    changes = db.total_changes
+    db.execute(
+        f"""WITH RECURSIVE
+        resistance_classes(x) AS (
+            SELECT s FROM objs WHERE p = ? AND o IN ({class_params}) AND s NOT IN ({phenotype_params})
+        ),
+        ancestors(phenotype, ancestor) AS (
+            SELECT DISTINCT o, o FROM objs WHERE p = ?
+            UNION
+            SELECT a.phenotype, sc.o FROM ancestors a JOIN objs sc ON sc.s = a.ancestor AND sc.p = ?
+        )
+        INSERT INTO objs (c, s, p, o)
+        SELECT DISTINCT ?, r.s, ?, a.ancestor FROM objs r
+        JOIN ancestors a ON a.phenotype = r.o
+        JOIN resistance_classes rc ON rc.x = a.ancestor
+        WHERE r.p = ? AND NOT EXISTS (
+            SELECT 1 FROM objs x WHERE x.s = r.s AND x.p = ? AND x.o = a.ancestor
+        )""",
+        (
+            rdfs_subclassof, *[cls.storid for cls in class_roots], *[cls.storid for cls in phenotype_roots],
+            onto.has_predicted_phenotype.storid,
+            rdfs_subclassof,
+            c, onto.has_resistance_class.storid,
+            onto.has_predicted_phenotype.storid,
+            onto.has_resistance_class.storid,
+        )
+    )
+    return db.total_changes - changes
+
+def find_disjoint_violations(onto: Ontology, db) -> list:
+    """Find the individuals that are instances of two classes declared disjoint
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    db : sqlite3.Connection
+        Connection to the quadstore
+
+    Returns
+    -------
+    list
+        List of (individual, class, class) tuples, one for each violation
+    """
+    members = {}
+    violations = []
+    for disjoint in onto.disjoint_classes():
+        classes = [cls for cls in disjoint.entities if isinstance(cls, ThingClass)]
+
+        # Get the individuals of each class and its subclasses once
+        for cls in classes:
+            if cls not in members:
+                members[cls] = set(s for (s,) in db.execute(
+                    """WITH RECURSIVE descendants(x) AS (
+                        SELECT ?
+                        UNION
+                        SELECT sc.s FROM objs sc JOIN descendants d ON sc.o = d.x WHERE sc.p = ?
+                    )
+                    SELECT DISTINCT t.s FROM objs t JOIN descendants d ON t.o = d.x WHERE t.p = ?""",
+                    (cls.storid, rdfs_subclassof, rdf_type)
+                ))
+
+        for i, a in enumerate(classes):
+            for b in classes[i + 1:]:
+                for s in members[a] & members[b]:
+                    violations.append((onto.world._unabbreviate(s), a.name, b.name))
+
+    return violations
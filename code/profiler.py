@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import resource
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+from owlready2 import Ontology, rdf_type, owl_class, owl_named_individual
+
+# Set this environment variable to also dump a cProfile of each stage next to the report
+cprofile_env = 'PANRES_CPROFILE'
+
+def count_entities(onto: Ontology) -> dict:
+    """Count the individuals, classes and triples in the quadstore of the ontology
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+
+    Returns
+    -------
+    dict
+        Number of individuals, classes and triples
+    """
+    db = onto.world.graph.db
+    individuals = db.execute("SELECT COUNT(DISTINCT s) FROM objs WHERE p = ? AND o = ?", (rdf_type, owl_named_individual)).fetchone()[0]
+    classes = db.execute("SELECT COUNT(DISTINCT s) FROM objs WHERE p = ? AND o = ?", (rdf_type, owl_class)).fetchone()[0]
+    triples = db.execute("SELECT (SELECT COUNT(*) FROM objs) + (SELECT COUNT(*) FROM datas)").fetchone()[0]
+    return {'individuals': individuals, 'classes': classes, 'triples': triples}
+
+def peak_rss() -> int:
+    """Peak resident set size of the process so far, in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+class BuildProfiler:
+    """Records the resource usage of each build stage and writes it to a JSON report
+
+    For each stage, the wall and CPU time, the peak resident set size of the process after the
+    stage and how much the stage raised it, the peak and top allocations traced by tracemalloc,
+    and the number of individuals, classes and triples added to the quadstore are recorded. When the environment variable PANRES_CPROFILE is
+    set, a cProfile dump of each stage is written next to the report as well.
+
+    The parse phases running in worker processes are not traced, only the time spent
+    waiting for them is included in the stage.
+
+    Parameters
+    ----------
+    report_dir : str
+        Directory to write the report (build_<timestamp>.json) and cProfile dumps to
+    top : int, optional
+        Number of top allocations to report per stage, by default 10
+    trace_memory : bool, optional
+        Trace the allocations with tracemalloc, which slows down the build, by default True
+    """
+
+    def __init__(self, report_dir: str, top: int = 10, trace_memory: bool = True):
+        self.top = top
+        self.trace_memory = trace_memory
+        self.started = datetime.now()
+        self.report_dir = report_dir
+        self.report_file = os.path.join(report_dir, f"build_{self.started.strftime('%Y%m%d_%H%M%S')}.json")
+        self.cprofile = os.environ.get(cprofile_env) is not None
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str, onto: Ontology):
+        """Profile the code run inside the context as one build stage
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        onto : Ontology
+            The ontology the stage works on
+        """
+        counts = count_entities(onto)
+        rss_before = peak_rss()
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.clear_traces()
+            tracemalloc.reset_peak()
+
+        profile = None
+        if self.cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+            if profile is not None:
+                profile.disable()
+                os.makedirs(self.report_dir, exist_ok=True)
+                profile_file = os.path.join(self.report_dir, f"build_{self.started.strftime('%Y%m%d_%H%M%S')}_{len(self.stages):02d}_{name}.prof")
+                pstats.Stats(profile).dump_stats(profile_file)
+
+            traced_peak, top_allocations = None, []
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                _, traced_peak = tracemalloc.get_traced_memory()
+                top_allocations = [
+                    {'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", 'size': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:self.top]
+                ]
+
+            added = {k: v - counts[k] for k, v in count_entities(onto).items()}
+            process_peak = peak_rss()
+
+            self.stages.append({
+                'name': name,
+                'cached': False,
+                'wall_time': round(wall, 4),
+                'cpu_time': round(cpu, 4),
+                # The peak is over the lifetime of the process, a stage using less memory than an earlier one does not raise it
+                'process_peak_rss': process_peak,
+                'peak_rss_increase': process_peak - rss_before,
+                'traced_peak': traced_peak,
+                'top_allocations': top_allocations,
+                'added': added,
+                'cprofile': profile_file if profile is not None else None,
+            })
+
+    def skip(self, name: str):
+        """Record a stage restored from the stage cache instead of being run
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        """
+        self.stages.append({'name': name, 'cached': True})
+
+    def write(self, **info) -> str:
+        """Write the JSON report of the build
+
+        Parameters
+        ----------
+        **info
+            Extra information about the build to include in the report
+
+        Returns
+        -------
+        str
+            Path of the report
+        """
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        report = {
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_time': round(sum(s.get('wall_time', 0) for s in self.stages), 4),
+            'cpu_time': round(sum(s.get('cpu_time', 0) for s in self.stages), 4),
+            'peak_rss': peak_rss(),
+            **info,
+            'stages': self.stages,
+        }
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        with open(self.report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        return self.report_file
@@ -0,0 +1,283 @@
+import json
+import time
+import sqlite3
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from owlready2 import Ontology
+from loguru import logger
+
+# NCBI E-utilities endpoint linking records of one database to another
+elink_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi"
+
+class RateLimiter:
+    """Limit the number of requests per second over all threads
+
+    Parameters
+    ----------
+    rate : float
+        Maximum number of requests per second
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request is allowed"""
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class PubMedLookup:
+    """Batched lookup of the PubMed IDs linked to sequence accessions, with a persistent cache
+
+    Accessions are looked up with NCBI ELink, many per request, running a bounded number of
+    requests concurrently while keeping below the NCBI rate limit (3 requests per second, or
+    10 with an API key). Results are stored in an SQLite cache, so every accession is only
+    looked up once. With a fixture, the lookup runs offline: accessions missing from the
+    cache are answered from the fixture instead of from NCBI.
+
+    Parameters
+    ----------
+    cache_file : str
+        Path to the SQLite cache of accession to PubMed IDs, created if it does not exist
+    fixture : str, optional
+        Path to a JSON file mapping accessions to lists of PubMed IDs, used instead of NCBI, by default None
+    db : str, optional
+        NCBI database of the accessions, by default 'protein'
+    batch_size : int, optional
+        Number of accessions per request, by default 200
+    workers : int, optional
+        Number of concurrent requests, by default 3
+    rate : float, optional
+        Maximum number of requests per second, by default 3 without and 10 with an API key
+    api_key : str, optional
+        NCBI API key, by default None
+    email : str, optional
+        Contact e-mail address sent along with the requests, as asked by NCBI, by default None
+    retries : int, optional
+        Number of retries of a failed request, by default 3
+    """
+
+    def __init__(self, cache_file: str, fixture: str = None, db: str = 'protein', batch_size: int = 200, workers: int = 3,
+                 rate: float = None, api_key: str = None, email: str = None, retries: int = 3):
+        self.db = db
+        self.batch_size = batch_size
+        self.workers = workers
+        self.api_key = api_key
+        self.email = email
+        self.retries = retries
+        self.limiter = RateLimiter(rate or (10 if api_key else 3))
+
+        self.fixture = None
+        if fixture is not None:
+            with open(fixture) as f:
+                self.fixture = {acc: [str(pmid) for pmid in pmids] for acc, pmids in json.load(f).items()}
+
+        self.cache = sqlite3.connect(cache_file)
+        self.cache.execute("CREATE TABLE IF NOT EXISTS pubmed (db TEXT, accession TEXT, pmids TEXT, PRIMARY KEY (db, accession))")
+
+    def lookup(self, accessions: list) -> dict:
+        """Look up the PubMed IDs of the accessions
+
+        Parameters
+        ----------
+        accessions : list
+            The sequence accessions
+
+        Returns
+        -------
+        dict
+            Lists of PubMed IDs keyed by accession. Accessions whose lookup failed are left out.
+        """
+        accessions = list(dict.fromkeys(accessions))
+        results = self.cached(accessions)
+
+        missing = [acc for acc in accessions if acc not in results]
+        if len(missing) == 0:
+            return results
+
+        # Answer from the fixture, or from NCBI in concurrent batches
+        if self.fixture is not None:
+            fetched = {acc: self.fixture.get(acc, []) for acc in missing}
+        else:
+            fetched = {}
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for batch, batch_result in zip(batches, executor.map(self.fetch, batches)):
+                    if len(batch_result) < len(batch):
+                        logger.warning(f"PubMed: Failed to look up {len(batch) - len(batch_result)} of {len(batch)} accessions.")
+                    fetched.update(batch_result)
+
+        # Store the new results in the cache
+        with self.cache:
+            self.cache.executemany(
+                "INSERT OR REPLACE INTO pubmed VALUES (?, ?, ?)",
+                [(self.db, acc, ';'.join(pmids)) for acc, pmids in fetched.items()]
+            )
+
+        results.update(fetched)
+        return results
+
+    def cached(self, accessions: list) -> dict:
+        """Get the cached PubMed IDs of the accessions
+
+        Parameters
+        ----------
+        accessions : list
+            The sequence accessions
+
+        Returns
+        -------
+        dict
+            Lists of PubMed IDs keyed by accession, for the cached accessions only
+        """
+        results = {}
+        for i in range(0, len(accessions), 500):
+            batch = accessions[i:i + 500]
+            rows = self.cache.execute(
+                f"SELECT accession, pmids FROM pubmed WHERE db = ? AND accession IN ({','.join(['?'] * len(batch))})",
+                [self.db] + batch
+            )
+            for acc, pmids in rows:
+                results[acc] = pmids.split(';') if pmids else []
+        return results
+
+    def fetch(self, accessions: list) -> dict:
+        """Look up a batch of accessions with ELink
+
+        The link sets are matched to the accessions by the IDs they list. When the request fails,
+        or some accessions cannot be matched (e.g. because ELink lists them by their UID), the
+        unresolved accessions are split in two halves that are looked up again, down to single
+        accessions, whose link set can only belong to that accession.
+
+        Parameters
+        ----------
+        accessions : list
+            The sequence accessions
+
+        Returns
+        -------
+        dict
+            Lists of PubMed IDs keyed by accession, leaving out the accessions whose lookup failed
+        """
+        linksets = self.request(accessions)
+        if linksets is None:
+            linksets = []
+
+        # Accessions are also matched without their version, as in the ids of the link sets
+        keys = {}
+        for acc in accessions:
+            keys.setdefault(acc.rsplit('.', 1)[0], acc)
+            keys[acc] = acc
+
+        results = {}
+        for linkset in linksets:
+            ids = [keys.get(str(i)) for i in linkset.get('ids', [])]
+            ids = [acc for acc in ids if acc is not None]
+            if len(ids) == 0 and len(accessions) == 1 and len(linksets) == 1:
+                ids = accessions
+            for acc in ids:
+                results[acc] = linkset_pmids(linkset)
+
+        unresolved = [acc for acc in accessions if acc not in results]
+        if len(unresolved) == 0:
+            return results
+        if len(accessions) == 1:
+            logger.warning(f"PubMed: No link set returned by ELink for {accessions[0]}.")
+            return results
+
+        # Look up the rest again in two halves
+        half = (len(unresolved) + 1) // 2
+        for part in [unresolved[:half], unresolved[half:]]:
+            if len(part) > 0:
+                results.update(self.fetch(part))
+        return results
+
+    def request(self, accessions: list) -> list:
+        """Send a single ELink request for a batch of accessions, retrying when it fails
+
+        Parameters
+        ----------
+        accessions : list
+            The sequence accessions
+
+        Returns
+        -------
+        list
+            The link sets returned by ELink, or None if the request failed
+        """
+        params = [('dbfrom', self.db), ('db', 'pubmed'), ('retmode', 'json')] + [('id', acc) for acc in accessions]
+        if self.api_key is not None:
+            params.append(('api_key', self.api_key))
+        if self.email is not None:
+            params.append(('email', self.email))
+        data = urllib.parse.urlencode(params).encode()
+
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                with urllib.request.urlopen(elink_url, data=data, timeout=60) as response:
+                    return json.load(response).get('linksets', [])
+            except (urllib.error.URLError, TimeoutError, json.JSONDecodeError) as e:
+                if attempt == self.retries:
+                    logger.warning(f"PubMed: ELink request for {len(accessions)} accessions failed: {e}")
+                    return None
+                time.sleep(2 ** attempt)
+
+    def close(self):
+        self.cache.close()
+
+def linkset_pmids(linkset: dict) -> list:
+    """Get the PubMed IDs of an ELink link set, without duplicates"""
+    pmids = []
+    for linksetdb in linkset.get('linksetdbs', []):
+        if linksetdb.get('dbto') == 'pubmed':
+            pmids.extend(str(pmid) for pmid in linksetdb.get('links', []))
+    return list(dict.fromkeys(pmids))
+
+def add_pubmed_annotations(onto: Ontology, logger, cache_file: str, fixture: str = None, **kwargs):
+    """Annotate the pan genes and original genes with the PubMed IDs linked to their accessions
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    logger : loguru.logger
+        Logger object for logging messages
+    cache_file : str
+        Path to the SQLite cache of the lookups
+    fixture : str, optional
+        Path to a JSON file mapping accessions to PubMed IDs, to run offline, by default None
+    **kwargs
+        Further options of PubMedLookup
+    """
+
+    # Collect the accessions of all genes
+    genes = [gene for cls in [onto.PanGene, onto.OriginalGene] for gene in cls.instances() if len(gene.accession) > 0]
+    accessions = [acc for gene in genes for acc in gene.accession]
+
+    # Look up all accessions at once
+    pubmed_lookup = PubMedLookup(cache_file=cache_file, fixture=fixture, **kwargs)
+    try:
+        pmids = pubmed_lookup.lookup(accessions)
+    finally:
+        pubmed_lookup.close()
+
+    # Add the PubMed IDs to the genes
+    n_annotated = 0
+    for gene in genes:
+        gene_pmids = list(dict.fromkeys(pmid for acc in gene.accession for pmid in pmids.get(acc, [])))
+        new_pmids = [pmid for pmid in gene_pmids if pmid not in gene.pubmed]
+        if new_pmids:
+            gene.pubmed.extend(new_pmids)
+            n_annotated += 1
+
+    logger.success(f"Added PubMed IDs to {n_annotated} of {len(genes)} genes with accessions.")
@@ -0,0 +1,252 @@
+import os
+import re
+import gzip
+from array import array
+import numpy as np
+from owlready2 import default_world, get_ontology, Ontology
+
+def open_file(file: str):
+    """Open a plain or gzip-compressed file for buffered binary reading
+
+    Parameters
+    ----------
+    file : str
+        Path to the file, gzip-compressed files are recognised by their magic number
+
+    Returns
+    -------
+    file object
+        Binary file object
+    """
+    with open(file, 'rb') as f:
+        is_gzip = f.read(2) == b'\x1f\x8b'
+    
+    if is_gzip:
+        return gzip.open(file, 'rb')
+    return open(file, 'rb', buffering=1 << 20)
+
+def is_quadstore(file: str) -> bool:
+    """Check whether a file is an owlready2 SQLite quadstore rather than an RDF/XML or OWL file
+
+    Parameters
+    ----------
+    file : str
+        Path to the file
+
+    Returns
+    -------
+    bool
+        True if the file is an SQLite database
+    """
+    with open(file, 'rb') as f:
+        return f.read(16) == b'SQLite format 3\x00'
+
+def load_ontology(file: str, base_iri: str = "http://genepi.dk/PanResOntology.owl") -> Ontology:
+    """Load the PanRes ontology from an OWL file or from an SQLite quadstore written by the build
+
+    A quadstore is opened read-only in the default world, without parsing it, so loading is
+    near-instant and the triples are only read from disk when they are queried. Other files
+    are parsed with owlready2 as usual. The indices of functions.py are cleared, as the
+    entities indexed before may belong to another quadstore.
+
+    Parameters
+    ----------
+    file : str
+        Path to the ontology file (.owl) or quadstore (.sqlite3)
+    base_iri : str, optional
+        IRI of the ontology in the quadstore, by default "http://genepi.dk/PanResOntology.owl"
+
+    Returns
+    -------
+    Ontology
+        The loaded ontology
+    """
+    # Imported here, as functions.py imports this module
+    from functions import clear_entity_index, clear_database_index, clear_property_index, clear_hierarchy_index
+    clear_entity_index()
+    clear_database_index()
+    clear_property_index()
+    clear_hierarchy_index()
+
+    if is_quadstore(file):
+        default_world.set_backend(filename=file, read_only=True, exclusive=False)
+        return get_ontology(base_iri)
+
+    return get_ontology(file).load()
+
+def read_fasta_headers(file: str):
+    """Stream the headers of a (gzip-compressed) FASTA file, one at a time and in constant memory
+
+    Parameters
+    ----------
+    file : str
+        Path to the FASTA file
+
+    Yields
+    ------
+    str
+        The header line without the leading '>', including any description after the identifier
+    """
+    with open_file(file) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                yield line[1:].strip().decode()
+
+# Member line of a CD-HIT cluster, e.g. "1\t1197aa, >pan_7774_v1.0.1_ide... at 97.83%"
+cdhit_member = re.compile(rb"^\d+\s+(\d+)(?:aa|nt), >(.+?)\.\.\. (?:(\*)|at (?:[+-]/)?([\d.]+)%)")
+
+# Row layout of the cluster-membership table
+cluster_table_dtype = np.dtype([
+    ('cluster', '<i4'),
+    ('length', '<i4'),
+    ('identity', '<f4'),
+    ('representative', '?'),
+])
+
+def read_cdhit_clusters(file: str):
+    """Stream the clusters of a (gzip-compressed) CD-HIT .clstr file, one cluster at a time
+
+    Parameters
+    ----------
+    file : str
+        Path to the .clstr file
+
+    Yields
+    ------
+    tuple
+        (representative, members, lengths, identities) for each cluster, including the last one.
+        members are the sequence identifiers as truncated by CD-HIT, lengths their sequence lengths
+        and identities their identity (%) to the representative, None for the representative itself.
+    """
+    representative, members, lengths, identities = None, [], [], []
+    with open_file(file) as f:
+        for line in f:
+            # A new cluster starts, pass on the previous one
+            if line.startswith(b'>'):
+                if members:
+                    yield representative, members, lengths, identities
+                representative, members, lengths, identities = None, [], [], []
+                continue
+
+            m = cdhit_member.match(line)
+            if m is None:
+                continue
+
+            name = m.group(2).decode()
+            members.append(name)
+            lengths.append(int(m.group(1)))
+            if m.group(3) is not None:
+                representative = name
+                identities.append(None)
+            else:
+                identities.append(float(m.group(4)))
+
+    # The last cluster is not followed by another cluster line
+    if members:
+        yield representative, members, lengths, identities
+
+class CdhitTableWriter:
+    """Write CD-HIT clusters to a compact cluster-membership table while they are streamed
+
+    The table consists of two files: ``{prefix}.members.txt`` with one member identifier per line,
+    and ``{prefix}.clusters.npy`` with one row per member (cluster id, length, identity and whether it
+    is the cluster representative) in the same order. The identity of a representative is stored as NaN.
+    Both files are written to temporary files first and only replace the table when it is complete.
+    Load the table with `load_cdhit_table`.
+
+    Parameters
+    ----------
+    prefix : str
+        Path prefix of the output files
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.n = 0
+        self.clusters, self.lengths, self.identities, self.representatives = array('i'), array('i'), array('f'), array('b')
+        self.members_tmp = f"{prefix}.members.txt.tmp"
+        self.clusters_tmp = f"{prefix}.clusters.tmp.npy"
+        self.names = open(self.members_tmp, 'w')
+
+    def add(self, representative: str, members: list, lengths: list, identities: list):
+        """Add a cluster as yielded by `read_cdhit_clusters`"""
+        for member, length, identity in zip(members, lengths, identities):
+            self.names.write(member + '\n')
+            self.clusters.append(self.n)
+            self.lengths.append(length)
+            self.identities.append(float('nan') if identity is None else identity)
+            self.representatives.append(member == representative)
+        self.n += 1
+
+    def close(self):
+        """Write the table and move both files in place"""
+        self.names.close()
+
+        table = np.empty(len(self.clusters), dtype=cluster_table_dtype)
+        table['cluster'] = np.frombuffer(self.clusters, dtype=np.int32)
+        table['length'] = np.frombuffer(self.lengths, dtype=np.int32)
+        table['identity'] = np.frombuffer(self.identities, dtype=np.float32)
+        table['representative'] = np.frombuffer(self.representatives, dtype=np.int8).astype(bool)
+        np.save(self.clusters_tmp, table)
+
+        # Replace the files only when both are complete, so a memory-mapped table is never replaced halfway
+        os.replace(self.members_tmp, f"{self.prefix}.members.txt")
+        os.replace(self.clusters_tmp, f"{self.prefix}.clusters.npy")
+
+    def abort(self):
+        """Remove the temporary files, leaving any existing table untouched"""
+        self.names.close()
+        for tmp in [self.members_tmp, self.clusters_tmp]:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_cdhit_table(file: str, prefix: str) -> int:
+    """Write the clusters of a CD-HIT .clstr file as a compact cluster-membership table
+
+    See `CdhitTableWriter` for the layout of the table.
+
+    Parameters
+    ----------
+    file : str
+        Path to the .clstr file
+    prefix : str
+        Path prefix of the output files
+
+    Returns
+    -------
+    int
+        Number of clusters written
+    """
+    with CdhitTableWriter(prefix) as table:
+        for cluster in read_cdhit_clusters(file):
+            table.add(*cluster)
+    return table.n
+
+def load_cdhit_table(prefix: str):
+    """Load a cluster-membership table written by `write_cdhit_table`
+
+    Parameters
+    ----------
+    prefix : str
+        Path prefix of the table files
+
+    Returns
+    -------
+    tuple
+        (members, table): the list of member identifiers and the memory-mapped structured array
+        with the fields 'cluster', 'length', 'identity' and 'representative'
+    """
+    with open(f"{prefix}.members.txt") as f:
+        members = [line.rstrip('\n') for line in f]
+
+    table = np.load(f"{prefix}.clusters.npy", mmap_mode='r')
+    return members, table
@@ -0,0 +1,393 @@
+import os
+import re
+import glob
+import pickle
+import shutil
+import sqlite3
+import hashlib
+import inspect
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from owlready2 import default_world, get_ontology, Ontology
+from functions import clear_entity_index, clear_database_index, clear_property_index, clear_hierarchy_index
+from targets import clear_target_table
+
+# Directory of the build code, only the modules in here are hashed into the stage keys
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules shared by all stages; editing any of them invalidates every cached stage
+common_code = [
+    os.path.join(code_dir, f)
+    for f in ['model.py', 'functions.py', 'targets.py', 'readers.py', 'stages.py']
+]
+
+class Stage:
+    """A single step of the ontology build.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, used for logging and for naming the cached snapshot
+    func : callable
+        Function running the stage. It is called as ``func(onto=onto, logger=logger, **kwargs)``
+    inputs : list, optional
+        Data files read by the stage, by default None
+    kwargs : dict, optional
+        Extra keyword arguments passed on to ``func``, by default None
+    parse : callable, optional
+        Function parsing the input files without using the ontology, by default None.
+        It is called as ``parse(**kwargs)``, possibly in a worker process, and its
+        result is passed on to ``func`` as ``parsed``.
+    outputs : list, optional
+        Files written by the stage besides the ontology, by default None. A cached
+        snapshot of the stage is only used while all of these files exist.
+    """
+
+    def __init__(self, name: str, func, inputs: list = None, kwargs: dict = None, parse = None, outputs: list = None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or []
+        self.kwargs = kwargs or {}
+        self.parse = parse
+        self.outputs = outputs or []
+
+    def run(self, onto: Ontology, logger, parsed = None):
+        if self.parse is not None:
+            self.func(onto=onto, logger=logger, parsed=parsed, **self.kwargs)
+        else:
+            self.func(onto=onto, logger=logger, **self.kwargs)
+
+    def key(self, upstream: str) -> str:
+        """Content hash of the stage: its inputs, its code, its arguments and the hash of the upstream stage.
+
+        Parameters
+        ----------
+        upstream : str
+            Hash of the preceding stage ('' for the first stage)
+
+        Returns
+        -------
+        str
+            Hex digest identifying the ontology state after this stage
+        """
+        h = hashlib.sha256()
+        h.update(upstream.encode())
+        h.update(self.name.encode())
+        h.update(repr(sorted(self.kwargs.items())).encode())
+
+        sources, code_files = function_code(self.func)
+        for source in sources:
+            h.update(source.encode())
+        for f in sorted(code_files | set(common_code)) + list(self.inputs):
+            h.update(f.encode())
+            h.update(file_digest(f).encode())
+
+        return h.hexdigest()
+
+    def parse_key(self) -> str:
+        """Content hash of the parse phase: its inputs, its code and its arguments
+
+        Returns
+        -------
+        str
+            Hex digest identifying the parsed input files
+        """
+        h = hashlib.sha256()
+        h.update(self.name.encode())
+        h.update(self.parse.__name__.encode())
+        h.update(repr(sorted(self.kwargs.items())).encode())
+
+        sources, code_files = function_code(self.parse)
+        for source in sources:
+            h.update(source.encode())
+        for f in sorted(code_files) + list(self.inputs):
+            h.update(f.encode())
+            h.update(file_digest(f).encode())
+
+        return h.hexdigest()
+
+
+def function_code(func) -> tuple:
+    """Collect the code a stage function depends on, to hash into the stage key
+
+    The source of the function is collected, together with the source of the functions and
+    classes of the same module it refers to (following the functions recursively) and the
+    values of the module-level constants it refers to. Other modules of the build are
+    collected as whole files. Editing other parts of the module of the function, e.g. the
+    help texts of PanResOntology.py, therefore does not change the key.
+
+    Parameters
+    ----------
+    func : callable
+        The stage or parse function
+
+    Returns
+    -------
+    tuple
+        List of the collected sources and set of the paths of the other modules
+    """
+    sources = []
+    files = set()
+    visited = set()
+
+    def code_names(code):
+        names = list(code.co_names)
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                names.extend(code_names(const))
+        return names
+
+    def build_file(obj) -> str:
+        try:
+            file = inspect.getsourcefile(obj)
+        except TypeError:
+            return None
+        if file is None or not os.path.abspath(file).startswith(code_dir + os.sep):
+            return None
+        return os.path.abspath(file)
+
+    def render(value) -> str:
+        # A stable text form of a constant, without the memory addresses of its repr
+        if inspect.isfunction(value):
+            visit(value)
+            return f"<function {value.__qualname__}>"
+        if isinstance(value, dict):
+            return '{' + ', '.join(f"{render(k)}: {render(v)}" for k, v in value.items()) + '}'
+        if isinstance(value, (list, tuple)):
+            return '[' + ', '.join(render(v) for v in value) + ']'
+        if isinstance(value, (set, frozenset)):
+            # Sets are sorted, as their order changes between processes
+            return '{' + ', '.join(sorted(render(v) for v in value)) + '}'
+        if isinstance(value, (str, int, float, bool, type(None), re.Pattern)):
+            return repr(value)
+        return None
+
+    def visit(f):
+        if f in visited:
+            return
+        visited.add(f)
+
+        # The shared modules are hashed as a whole
+        file = build_file(f)
+        if file in common_code:
+            files.add(file)
+            return
+        sources.append(inspect.getsource(f))
+
+        # Follow the names used in the function, or in the methods of the class
+        functions = [f] if inspect.isfunction(f) else [m for m in vars(f).values() if inspect.isfunction(m)]
+        names = {}
+        for function in functions:
+            for name in code_names(function.__code__):
+                if name in function.__globals__:
+                    names[name] = function.__globals__[name]
+
+        for name, obj in names.items():
+            if inspect.ismodule(obj) or inspect.isfunction(obj) or inspect.isclass(obj):
+                obj_file = build_file(obj)
+                if obj_file is None:
+                    continue
+                if obj_file == file and not inspect.ismodule(obj):
+                    visit(obj)
+                else:
+                    files.add(obj_file)
+            else:
+                value = render(obj)
+                if value is not None:
+                    sources.append(f"{name} = {value}")
+
+    visit(func)
+    return sources, files
+
+def cached_parse(parse, kwargs: dict, path: str = None):
+    """Run the parse phase of a stage, reusing the result pickled by an earlier build when available
+
+    Parameters
+    ----------
+    parse : callable
+        The parse function of the stage
+    kwargs : dict
+        Keyword arguments for the parse function
+    path : str, optional
+        Path of the pickled result, by default None (no caching)
+
+    Returns
+    -------
+    object
+        The parsed input
+    """
+    if path is not None and os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    parsed = parse(**kwargs)
+
+    if path is not None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    return parsed
+
+
+def parse_path(cache_dir: str, stage: Stage) -> str:
+    if cache_dir is None:
+        return None
+
+    # Remove parse results from outdated inputs of this stage
+    path = os.path.join(cache_dir, 'parsed', f"{stage.name}_{stage.parse_key()[:16]}.pkl")
+    for old in glob.glob(os.path.join(cache_dir, 'parsed', f"{stage.name}_*.pkl")):
+        if old != path:
+            os.remove(old)
+    return path
+
+
+def file_digest(file: str) -> str:
+    """Compute the sha256 digest of a file, reading it in blocks
+
+    Parameters
+    ----------
+    file : str
+        Path to the file
+
+    Returns
+    -------
+    str
+        Hex digest of the file content, or 'missing' if the file does not exist
+    """
+    if not os.path.exists(file):
+        return 'missing'
+
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def snapshot_path(cache_dir: str, i: int, stage: Stage, key: str) -> str:
+    return os.path.join(cache_dir, f"{i:02d}_{stage.name}_{key[:16]}.sqlite3")
+
+
+def save_snapshot(onto: Ontology, path: str):
+    """Copy the quadstore of the ontology's world into an SQLite file
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology to snapshot
+    path : str
+        Path of the snapshot file
+    """
+    onto.world.save()
+    tmp = path + '.tmp'
+    dst = sqlite3.connect(tmp)
+    onto.world.graph.db.backup(dst)
+    dst.close()
+    os.replace(tmp, path)
+
+
+def run_stages(stages: list, base_iri: str, logger, cache_dir: str = None, workers: int = None, profiler = None) -> Ontology:
+    """Run the build stages in order, resuming from the last cached stage that is still valid
+
+    Each stage is keyed by a content hash of its input files, its code and the key of
+    the preceding stage. After a stage has run, a snapshot of the quadstore is stored in
+    the cache directory. On the next build, the stages are skipped up to the last stage
+    whose snapshot matches its current key, and the build continues from that snapshot.
+
+    The parse phases of the stages that will run are started up front in a pool of
+    worker processes, while the stages themselves write to the ontology one at a time.
+    Parse results are cached as well, so a stage that reruns only because an upstream
+    stage changed does not parse its unchanged input files again.
+
+    Parameters
+    ----------
+    stages : list
+        List of Stage objects, in the order they should run
+    base_iri : str
+        IRI of the ontology being built
+    logger : loguru.logger
+        Logger object for logging messages
+    cache_dir : str, optional
+        Directory to store stage snapshots in, by default None (no caching)
+    workers : int, optional
+        Number of worker processes for the parse phases, by default None (one per CPU).
+        With 1 worker, the parse phases run in the main process.
+    profiler : BuildProfiler, optional
+        Profiler recording the resource usage of each stage, by default None
+
+    Returns
+    -------
+    Ontology
+        The built ontology
+    """
+
+    # Chain the stage keys
+    keys = []
+    for stage in stages:
+        keys.append(stage.key(keys[-1] if keys else ''))
+
+    # Find the last stage with a valid snapshot, rerunning stages whose output files are missing
+    resume = -1
+    if cache_dir is not None:
+        os.makedirs(os.path.join(cache_dir, 'parsed'), exist_ok=True)
+        for i, stage in enumerate(stages):
+            if os.path.exists(snapshot_path(cache_dir, i, stage, keys[i])) and all(os.path.exists(f) for f in stage.outputs):
+                resume = i
+            else:
+                break
+
+    # Restore the snapshot into the world, working on a copy so the snapshot stays intact
+    if resume >= 0:
+        work = os.path.join(cache_dir, 'work.sqlite3')
+        shutil.copyfile(snapshot_path(cache_dir, resume, stages[resume], keys[resume]), work)
+        default_world.set_backend(filename=work)
+        logger.info(f"Resuming build from cached stage '{stages[resume].name}' ({resume + 1}/{len(stages)}).")
+
+    onto = get_ontology(base_iri)
+
+    if profiler is not None:
+        for stage in stages[:resume + 1]:
+            profiler.skip(stage.name)
+
+    # Entities indexed before the restore belong to another quadstore
+    clear_entity_index()
+    clear_database_index()
+    clear_property_index()
+    clear_hierarchy_index()
+    clear_target_table()
+
+    # Start parsing the input files of the remaining stages in worker processes
+    parse_stages = [stage for stage in stages[resume + 1:] if stage.parse is not None]
+    executor = None
+    futures = {}
+    if len(parse_stages) > 0 and workers != 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        for stage in parse_stages:
+            futures[stage.name] = executor.submit(cached_parse, stage.parse, stage.kwargs, parse_path(cache_dir, stage))
+
+    try:
+        for i in range(resume + 1, len(stages)):
+            stage = stages[i]
+
+            with profiler.stage(stage.name, onto) if profiler is not None else nullcontext():
+                # Wait for the parse phase, or run it here
+                parsed = None
+                if stage.name in futures:
+                    parsed = futures.pop(stage.name).result()
+                elif stage.parse is not None:
+                    parsed = cached_parse(stage.parse, stage.kwargs, parse_path(cache_dir, stage))
+
+                stage.run(onto=onto, logger=logger, parsed=parsed)
+
+            if cache_dir is not None:
+                # Remove outdated snapshots of this stage before saving the new one
+                for old in glob.glob(os.path.join(cache_dir, f"{i:02d}_{stage.name}_*.sqlite3")):
+                    os.remove(old)
+                save_snapshot(onto, snapshot_path(cache_dir, i, stage, keys[i]))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    return onto
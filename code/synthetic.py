@@ -0,0 +1,259 @@
+import os
+import math
+import random
+import shutil
+import argparse
+import pandas as pd
+from loguru import logger
+
+from databases.argannot import acr2class
+from databases.resfinderfg import parse_resfinderfg_annotations
+
+# Number of genes in PanRes v1.0.0, the 1x scale
+panres_genes = 14078
+
+# Fractions of the PanRes genes that were discarded, and that have a protein sequence
+discarded_fraction = 2361 / panres_genes
+protein_fraction = 11717 / panres_genes
+
+# Average number of proteins in a CD-HIT cluster (50% identity, 90% coverage)
+protein_cluster_size = 11717 / 1802
+
+# Relative number of annotation entries per database in the PanRes metadata
+database_weights = {
+    'resfinder': 3,
+    'card_amr': 4,
+    'megares': 6,
+    'amrfinderplus': 6,
+    'argannot': 2,
+    'functional_amr': 2,
+    'metalres': 1,
+    'csabapal': 1,
+}
+
+metals = ['Copper', 'Zinc', 'Arsenic', 'Mercury', 'Silver', 'Cadmium/Zinc/Cobalt', 'Nickel/Cobalt']
+
+amino_acids = 'ACDEFGHIKLMNPQRSTVWY'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate synthetic, schema-compatible input files for building the ontology')
+
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        required=True,
+        help='Directory to write the synthetic data files to, with the same layout as data/',
+        dest='output'
+    )
+    parser.add_argument(
+        '-s', '--scale',
+        type=float,
+        default=1,
+        help=f'Number of genes relative to PanRes v1.0.0 ({panres_genes} genes), e.g. 1, 10 or 100',
+        dest='scale'
+    )
+    parser.add_argument(
+        '-d', '--data',
+        type=str,
+        default='data',
+        help='Directory with the real data files to derive the annotations from',
+        dest='data'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed of the random generator',
+        dest='seed'
+    )
+
+    return parser.parse_args()
+
+def replicate(file: str, output: str, n: int, rename: dict, sep: str = '\t', skiprows: int = 0, header_lines: list = None) -> list:
+    """Write n copies of an annotation table, renaming the join keys of every copy but the first
+
+    Parameters
+    ----------
+    file : str
+        Path to the real annotation table
+    output : str
+        Path of the synthetic annotation table
+    n : int
+        Number of copies
+    rename : dict
+        Functions renaming the values of a column for copy r, called as ``f(value, r)``, keyed by column name
+    sep : str, optional
+        Column separator, by default '\\t'
+    skiprows : int, optional
+        Number of lines preceding the table, by default 0
+    header_lines : list, optional
+        Lines to write before the table, by default None
+
+    Returns
+    -------
+    list
+        The copies of the table, as DataFrames
+    """
+    table = pd.read_csv(file, sep=sep, skiprows=skiprows, dtype=str, keep_default_na=False, on_bad_lines='skip')
+
+    copies = []
+    with open(output, 'w') as f:
+        for line in header_lines or []:
+            f.write(line + '\n')
+
+        for r in range(n):
+            copy = table.copy()
+            if r > 0:
+                for col, f_rename in rename.items():
+                    copy[col] = [f_rename(v, r) if v else v for v in copy[col]]
+            copy.to_csv(f, sep=sep, index=False, header=(r == 0))
+            copies.append(copy)
+    return copies
+
+def generate(output: str, scale: float = 1, data: str = 'data', seed: int = 0) -> int:
+    """Generate synthetic input files for every loader, with the gene count scaled relative to PanRes v1.0.0
+
+    The annotation tables are copies of the real tables in the data directory, repeated once per
+    started multiple of the scale with renamed join keys, so they grow with the scale as well. The
+    PanRes metadata table links the synthetic pan genes to entries of these tables, so the loaders
+    match the genes to annotations as they would with the real data.
+
+    Parameters
+    ----------
+    output : str
+        Directory to write the files to, with the same layout as the data directory
+    scale : float, optional
+        Number of genes relative to PanRes v1.0.0, by default 1
+    data : str, optional
+        Directory with the real data files, by default 'data'
+    seed : int, optional
+        Seed of the random generator, by default 0
+
+    Returns
+    -------
+    int
+        Number of generated pan genes
+    """
+    rng = random.Random(seed)
+    n_genes = max(1, round(panres_genes * scale))
+    n_copies = max(1, math.ceil(scale))
+
+    os.makedirs(os.path.join(output, 'discarded'), exist_ok=True)
+    os.makedirs(os.path.join(output, 'proteins'), exist_ok=True)
+
+    # The target vocabulary and acronym translations are not scaled
+    shutil.copyfile(os.path.join(data, 'targets.xlsx'), os.path.join(output, 'targets.xlsx'))
+    shutil.copyfile(os.path.join(data, 'resfinderfg_anno.txt'), os.path.join(output, 'resfinderfg_anno.txt'))
+    fg_acronyms = sorted(parse_resfinderfg_annotations(os.path.join(data, 'resfinderfg_anno.txt')))
+
+    # Copy the annotation tables, renaming their join keys
+    prefixed = lambda v, r: f"s{r}-{v}"
+
+    resfinder = replicate(
+        os.path.join(data, 'phenotypes.txt'), os.path.join(output, 'phenotypes.txt'), n_copies,
+        rename={'Gene_accession no.': prefixed}
+    )
+    card = replicate(
+        os.path.join(data, 'aro_index.tsv'), os.path.join(output, 'aro_index.tsv'), n_copies,
+        rename={'ARO Accession': lambda v, r: v.replace('ARO:', f"ARO:{r}")}
+    )
+    amrfinderplus = replicate(
+        os.path.join(data, 'ReferenceGeneCatalog.txt'), os.path.join(output, 'ReferenceGeneCatalog.txt'), n_copies,
+        rename={'refseq_protein_accession': prefixed}
+    )
+    csabapal = replicate(
+        os.path.join(data, 'QSX_607_CsabaPal_metagenomics_metadata_final_notfiltered.csv'),
+        os.path.join(output, 'QSX_607_CsabaPal_metagenomics_metadata_final_notfiltered.csv'), n_copies,
+        rename={'orf_unique': prefixed}, sep=','
+    )
+    megares = replicate(
+        os.path.join(data, 'megares_to_external_header_mappings_v3.00.csv'),
+        os.path.join(output, 'megares_to_external_header_mappings_v3.00.csv'), n_copies,
+        rename={'MEGARes_header': lambda v, r: v.replace('|', f"-s{r}|", 1)}, sep=';'
+    )
+    replicate(
+        os.path.join(data, 'BacMet_EXP.704.mapping.txt'), os.path.join(output, 'BacMet_EXP.704.mapping.txt'), n_copies,
+        rename={'Gene_name': lambda v, r: '/'.join([f"{alias}s{r}" for alias in v.split('/')])}
+    )
+
+    # Keys to draw the annotation entries of the genes from
+    resfinder_keys = [k for copy in resfinder for k in copy['Gene_accession no.']]
+    card_rows = [row for copy in card for row in zip(copy['ARO Accession'], copy['ARO Name'], copy['DNA Accession'])]
+    amrfinderplus_rows = [
+        row for copy in amrfinderplus
+        for row in zip(copy['refseq_protein_accession'], copy['gene_family'], copy['allele'], copy['product_name'])
+        if row[0]
+    ]
+    csabapal_keys = [k for copy in csabapal for k in copy['orf_unique']]
+    megares_headers = [h for copy in megares for h in copy['MEGARes_header'] if h.count('|') >= 4]
+    argannot_acronyms = sorted(acr2class)
+
+    def fasta_header(database: str, i: int, length: int) -> str:
+        if database == 'resfinder':
+            return rng.choice(resfinder_keys)
+        if database == 'card_amr':
+            aro, name, dna = rng.choice(card_rows)
+            return f"gb|{dna.split(';')[0] or f'SYN{i}'}|+|0-{length}|{aro}|{name} [Synthetic organism]"
+        if database == 'amrfinderplus':
+            accession, family, allele, product = rng.choice(amrfinderplus_rows)
+            return f"{i}|{accession}|1|1|{family}|{allele or family}|{product}"
+        if database == 'megares':
+            return rng.choice(megares_headers)
+        if database == 'csabapal':
+            return rng.choice(csabapal_keys)
+        if database == 'argannot':
+            return f"argannot~~~({rng.choice(argannot_acronyms)})syn{i}:SYN{i}:1-{length}:{length}"
+        if database == 'functional_amr':
+            return f"fg{i}|SYN{i}|{rng.choice(fg_acronyms)}"
+        if database == 'metalres':
+            return f"syn{i}_SYN{i} {rng.choice(metals)} resistance"
+
+    # Write the PanRes metadata, the gene clusters are consecutive runs of genes
+    databases = list(database_weights)
+    weights = list(database_weights.values())
+    discarded = set()
+    with open(os.path.join(output, 'PanRes_data_v1.0.0.tsv'), 'w') as f:
+        f.write(f"# Synthetic PanRes metadata, {scale}x PanRes v1.0.0\n")
+        f.write('\t'.join(['userGeneName', 'chosenSeq', 'database', 'fa_header', 'gene_len']) + '\n')
+
+        representative = 1
+        for i in range(1, n_genes + 1):
+            if rng.random() < 0.3:
+                representative = i
+            length = rng.randrange(300, 3000, 3)
+            for database in rng.sample(databases, counts=weights, k=rng.choice([1, 1, 1, 2, 2, 3])):
+                f.write('\t'.join([f"pan_{i}_v1.0.0", f"pan_{representative}_v1.0.0", f"{database}_genes", fasta_header(database, i, length), str(length)]) + '\n')
+
+            if rng.random() < discarded_fraction:
+                discarded.add(i)
+
+    with open(os.path.join(output, 'discarded', 'panres_removed_headers.txt'), 'w') as f:
+        for i in sorted(discarded):
+            f.write(f">pan_{i}_v1.0.1\n")
+
+    # Write the protein sequences and their CD-HIT clusters
+    proteins = [i for i in range(1, n_genes + 1) if i not in discarded and rng.random() < protein_fraction / (1 - discarded_fraction)]
+    with open(os.path.join(output, 'proteins', 'panres_final_protein.faa'), 'w') as faa, \
+         open(os.path.join(output, 'proteins', 'panres_final_protein_50_90.faa.clstr'), 'w') as clstr:
+        cluster = -1
+        member = 0
+        for i in proteins:
+            length = rng.randrange(100, 1000)
+            faa.write(f">pan_{i}_v1.0.1_identical\n{''.join(rng.choices(amino_acids, k=length))}\n")
+
+            if member == 0 or rng.random() < 1 / protein_cluster_size:
+                cluster += 1
+                member = 0
+                clstr.write(f">Cluster {cluster}\n")
+                identity = '*'
+            else:
+                identity = f"at {rng.uniform(50, 100):.2f}%"
+            clstr.write(f"{member}\t{length}aa, >pan_{i}_v1.0.1_ide... {identity}\n")
+            member += 1
+
+    return n_genes
+
+if __name__ == "__main__":
+    args = parse_args()
+    n = generate(output=args.output, scale=args.scale, data=args.data, seed=args.seed)
+    logger.success(f"Generated synthetic data for {n} genes in {args.output}.")
@@ -1,6 +1,11 @@
+import time
 import pandas as pd
+from collections import defaultdict
 from owlready2 import Thing, Ontology, destroy_entity
-from functions import get_or_create_subclass, get_instance
+from functions import get_or_create_subclass, get_instance, forget_entity, clear_property_index, clear_hierarchy_index
+
+# Resolution table for gene_target: normalised target name -> (target instance, kind, resistance classes)
+target_table = {}
 
 def load_targets(excelfile: str, onto: Ontology, logger=None) -> None:
     """Load resistance targets from an Excel file into the ontology
@@ -108,11 +113,65 @@ def load_targets(excelfile: str, onto: Ontology, logger=None) -> None:
         except: 
             pass
     
+    # Compile the resolution table for assigning targets to genes
+    compile_target_table(onto)
+
     # Log the successful loading of targets
     if logger is not None:
         logger.success("Loaded drugs, biocide and metal targets into the ontology.")
     
 
+def remove_unused_subclasses(onto: Ontology, parents: list, logger) -> None:
+    """
+    Remove the unused subclasses of several parent classes in one pass over the PanGene instances.
+
+    A subclass is unused if no PanGene links to it through the object property given for its parent.
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object to remove class instances from.
+    parents : list
+        List of (parent class, property name) tuples, e.g. [(onto.Metal, 'has_predicted_phenotype')]
+    logger : loguru.logger, optional
+        Logger object for logging messages, by default None
+    """
+    start = time.perf_counter()
+
+    # Check if the parent classes even exist
+    for parent_cls, property_name in parents:
+        if parent_cls is None and logger:
+            logger.error(f"Parent class for {property_name} is not defined in the ontology.")
+    parents = [(parent_cls, property_name) for parent_cls, property_name in parents if parent_cls is not None]
+
+    # Collect the classes referenced through each property in a single pass over the genes
+    referenced = {property_name: set() for _, property_name in parents}
+    for instance in onto.PanGene.instances():
+        for property_name, classes in referenced.items():
+            classes.update(getattr(instance, property_name, []))
+
+    # Find the unused subclasses of each parent class
+    unused_subclasses = {}
+    for parent_cls, property_name in parents:
+        all_classes = list(parent_cls.subclasses())
+        unused = [subclass for subclass in all_classes if subclass not in referenced[property_name]]
+        for subclass in unused:
+            unused_subclasses[subclass] = None
+
+        if logger:
+            logger.info(f"Destroying {len(unused)}/{len(all_classes)} subclasses of {parent_cls.name}")
+
+    # Remove unused subclasses in one batch
+    clear_target_table()
+    clear_property_index()
+    clear_hierarchy_index()
+    for subclass in unused_subclasses:
+        forget_entity(subclass)
+        destroy_entity(subclass)
+    
+    if logger:
+        logger.info(f"Destroyed {len(unused_subclasses)} unused subclasses in {time.perf_counter() - start:.2f}s")
+
 def remove_unused_subclasses_with_property(onto: Ontology, parent_cls: Thing, property_name: str, logger) -> None:
     """
     Remove all unused subclasses of a given parent class in the ontology that do not have a specific object property.
@@ -128,35 +187,112 @@ def remove_unused_subclasses_with_property(onto: Ontology, parent_cls: Thing, pr
     logger : loguru.logger, optional
         Logger object for logging messages, by default None
     """
-    # List for storing unused subclasses
-    unused_subclasses = []
+    remove_unused_subclasses(onto=onto, parents=[(parent_cls, property_name)], logger=logger)
+
 
-    # Check if parent class even exists
-    if parent_cls is None and logger :
-        logger.error(f"Parent class {parent_cls} is not defined in the ontology.")
-        return
+def target_entry(onto: Ontology, target_instance: Thing) -> tuple:
+    """Determine how a target is assigned to genes
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    target_instance : Thing
+        The target class, or None if the target was not found
+
+    Returns
+    -------
+    tuple
+        The target instance, its kind ('phenotype', 'class' or None) and the resistance classes it belongs to
+    """
+
+    # No match found!
+    if target_instance is None:
+        return (None, None, [])
     
-    # Get all subclasses of the given parent class
-    all_classes = list(parent_cls.subclasses())
-
-    # Loop through them
-    for subclass in all_classes:
-        has_property = False
-        for instance in onto.PanGene.instances():
-            # Check if the subclass has the specified object property
-            if subclass in getattr(instance, property_name, []):
-                has_property = True
-                break
-        
-        if not has_property:
-            unused_subclasses.append(subclass)
+    # Check if the target is a phenotype or a class
+    if any(
+        [
+            onto.AntibioticResistancePhenotype in target_instance.is_a, 
+            onto.Metal in target_instance.is_a, 
+            onto.Biocide in target_instance.is_a, 
+            onto.UnclassifiedResistance in target_instance.is_a
+        ]
+    ):
+        parent_classes = [
+            target_relation for target_relation in target_instance.is_a
+            if any([onto.AntibioticResistanceClass in target_relation.is_a, onto.BiocideClass in target_relation.is_a])
+        ]
+        return (target_instance, 'phenotype', parent_classes)
     
-    # Remove unused subclasses
-    for subclass in unused_subclasses:
-        destroy_entity(subclass)
+    if any(
+        [
+            onto.AntibioticResistanceClass in target_instance.is_a,
+            onto.BiocideClass in target_instance.is_a,
+            onto.MetalClass in target_instance.is_a,
+            onto.UnclassifiedResistanceClass in target_instance.is_a
+        ]
+    ):
+        return (target_instance, 'class', [])
+    
+    return (target_instance, None, [])
+
+def resolve_target(onto: Ontology, target: str) -> tuple:
+    """Resolve a normalised target name, creating drug combination targets when needed
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    target : str
+        The normalised target name
+
+    Returns
+    -------
+    tuple
+        Entry for the resolution table, see target_entry
+    """
+
+    # Get class from the ontology
+    target_instance = None
+    if '+' in target: # drug combination target
+        target_instance = get_or_create_subclass(onto = onto, parent_cls=onto.AntibioticResistancePhenotype, subclass_name=target)
+        target_instance.is_drug_combination.append(True)
+        # Split the drug combination targets +
+        for ts in target.split('+'):
+            ts_instance = get_instance(onto = onto, name = ts.replace(" ", "_"))
+            if ts_instance is not None and ts_instance not in target_instance.is_a:
+                target_instance.is_a.append(ts_instance)
+    else:
+        target_instance = get_instance(onto = onto, name = target)
     
-    logger.info(f"Destroyed {len(unused_subclasses)}/{len(all_classes)} subclasses of {parent_cls.name}")
+    return target_entry(onto = onto, target_instance = target_instance)
 
+def compile_target_table(onto: Ontology) -> None:
+    """Fill the resolution table used by gene_target with all targets loaded into the ontology
+
+    Parameters
+    ----------
+    onto : Ontology
+        The ontology object
+    """
+    target_table.clear()
+    roots = [
+        onto.AntibioticResistanceClass, onto.AntibioticResistancePhenotype,
+        onto.MetalClass, onto.Metal,
+        onto.BiocideClass, onto.Biocide,
+        onto.UnclassifiedResistanceClass, onto.UnclassifiedResistance,
+        onto.ResistanceMechanism
+    ]
+    for root in roots:
+        for target_instance in root.descendants(include_self = False):
+            # Drug combinations are completed by resolve_target on first use
+            if '+' not in target_instance.name:
+                target_table[target_instance.name] = target_entry(onto = onto, target_instance = target_instance)
+
+def clear_target_table() -> None:
+    """Empty the resolution table, e.g. after target classes have been removed"""
+    target_table.clear()
 
 def gene_target(gene: Thing, og: Thing, target: str, onto: Ontology, db_name: str = None):
     """Assign a resistance target to a gene and its original gene instance in the ontology.
@@ -180,68 +316,98 @@ def gene_target(gene: Thing, og: Thing, target: str, onto: Ontology, db_name: st
         True if target was found and assigned, False if not
     """
 
-    # Replace spaces and dashes with underscores
-    target = target.replace(" ", "_").replace("-", "_").title()
+    failed = apply_targets(assignments = [(gene, og, target, db_name)], onto = onto)
+    return len(failed) == 0
 
-    # Get class from the ontology
-    target_instance = None
-    if '+' in target: # drug combination target
-        target_instance = get_or_create_subclass(onto = onto, parent_cls=onto.AntibioticResistancePhenotype, subclass_name=target)
-        target_instance.is_drug_combination.append(True)
-        # Split the drug combination targets +
-        for ts in target.split('+'):
-            ts_instance = get_instance(onto = onto, name = ts.replace(" ", "_"))
-            if ts_instance is not None:
-                target_instance.is_a.append(ts_instance)
-    else:
-        target_instance = get_instance(onto = onto, name = target)
-    
-    # No match found!
-    if target_instance is None:
-        return False
-    
-    # Check if the target is a phenotype or a class
-    type_check = {
-        'phenotype': any(
-            [
-                onto.AntibioticResistancePhenotype in target_instance.is_a, 
-                onto.Metal in target_instance.is_a, 
-                onto.Biocide in target_instance.is_a, 
-                onto.UnclassifiedResistance in target_instance.is_a
-                ]
-        ),
-        'class': any(
-            [
-                onto.AntibioticResistanceClass in target_instance.is_a,
-                onto.BiocideClass in target_instance.is_a,
-                onto.MetalClass in target_instance.is_a,
-                onto.UnclassifiedResistanceClass in target_instance.is_a
-            ]
-        )
-    }
-
-    # Assign the relations based on whether the drug target is a phenotype or a class object
-    if type_check['phenotype']: 
-        og.has_predicted_phenotype.append(target_instance)
-
-        for target_relation in target_instance.is_a:
-            if any([onto.AntibioticResistanceClass in target_relation.is_a, onto.BiocideClass in target_relation.is_a]):
-                gene.has_resistance_class.append(target_relation)
-                og.has_resistance_class.append(target_relation)
-    elif type_check['class']: 
-        gene.has_resistance_class.append(target_instance)
-        og.has_resistance_class.append(target_instance)
-    else:
-        return False
-
-    # Assign in which database the target annotation was encountered
-    try:        
-        db_instance = get_instance(onto = onto, name = db_name)
-        target_instance.found_in.append(db_instance)
-    except TypeError:
-        pass
+def apply_targets(assignments, onto: Ontology) -> pd.DataFrame:
+    """Assign resistance targets to genes and their original gene instances in one batch.
+
+    The relations are collected and deduplicated first, and then written once per
+    instance and property.
+
+    Parameters
+    ----------
+    assignments : iterable
+        (gene, original gene, target, database name) tuples, as the arguments of gene_target,
+        optionally followed by the annotation the target was translated from, to report when
+        the target is not found
+    onto : Ontology
+        The ontology object
+
+    Returns
+    -------
+    pd.DataFrame
+        The assignments whose target was not found, with the columns pan_gene, original_gene, target,
+        database and annotation (the target if no annotation was given)
+    """
+
+    # Relations to add: (instance, property name) -> values, using a dict as an ordered set
+    relations = defaultdict(dict)
+    failed = []
+
+    for gene, og, target, db_name, *annotation in assignments:
+        # Replace spaces and dashes with underscores
+        name = target.replace(" ", "_").replace("-", "_").title()
+
+        # Get class from the resolution table, or resolve it from the ontology. Targets that are not
+        # found are not stored, as the class may still be created later in the build
+        entry = target_table.get(name)
+        if entry is None:
+            entry = resolve_target(onto = onto, target = name)
+            if entry[1] is not None:
+                target_table[name] = entry
+        target_instance, kind, parent_classes = entry
+
+        # Assign the relations based on whether the drug target is a phenotype or a class object
+        if kind == 'phenotype': 
+            relations[(og, 'has_predicted_phenotype')][target_instance] = None
+
+            for target_relation in parent_classes:
+                relations[(gene, 'has_resistance_class')][target_relation] = None
+                relations[(og, 'has_resistance_class')][target_relation] = None
+        elif kind == 'class': 
+            relations[(gene, 'has_resistance_class')][target_instance] = None
+            relations[(og, 'has_resistance_class')][target_instance] = None
+        else:
+            failed.append((gene.name, og.name, target, db_name, annotation[0] if annotation else target))
+            continue
+
+        # Assign in which database the target annotation was encountered
+        if db_name is not None:
+            db_instance = get_instance(onto = onto, name = db_name)
+            if db_instance is not None:
+                relations[(target_instance, 'found_in')][db_instance] = None
+
+    # Write the new values of each property at once
+    for (instance, property_name), values in relations.items():
+        current = getattr(instance, property_name)
+        new_values = [v for v in values if v not in current]
+        if new_values:
+            current.extend(new_values)
+
+    # The inverted property index no longer matches the genes' targets
+    clear_property_index()
+    clear_hierarchy_index()
     
-    return True
+    return pd.DataFrame(failed, columns = ['pan_gene', 'original_gene', 'target', 'database', 'annotation'])
+
+def format_failed_targets(failed: pd.DataFrame) -> str:
+    """Format failed target assignments for logging, one line per annotation
+
+    Parameters
+    ----------
+    failed : pd.DataFrame
+        Failed assignments as returned by apply_targets
+
+    Returns
+    -------
+    str
+        Lines of the form 'annotation: pan_gene (original_gene), ...'
+    """
+    lines = []
+    for annotation, m in failed.groupby('annotation', sort = False):
+        lines.append(f"{annotation}: {', '.join(m['pan_gene'] + ' (' + m['original_gene'] + ')')}")
+    return "\n".join(lines)
 
 def reclassify_genes(onto: Ontology):
     """Reclassifies genes in the ontology based on their predicted phenotypes and resistance classes.